@@ -2,22 +2,21 @@ import cv2
 import math
 import multiprocessing
 import queue
-import bisect
 import numpy as np
 
 
-def quantize(value, quant):
+def quantize(value, quant, mids=None):
     """Quantizes a value to the closest value in a list of quantized values.
     Args:
-        value (float): Value to be quantized
-        quant (List[float]): Quantized value options.
+        value (float or numpy.ndarray): Value(s) to be quantized
+        quant (numpy.ndarray): Quantized value options.
+        mids (numpy.ndarray, optional): Precomputed midpoints between the options. Defaults to None.
     Returns:
-        float: Quantized input value.
+        float or numpy.ndarray: Quantized input value(s).
     """
-    mids = [(quant[i] + quant[i + 1]) / 2.0
-            for i in range(len(quant) - 1)]
-    ind = bisect.bisect_right(mids, value)
-    return quant[ind]
+    if mids is None:
+        mids = (quant[:-1] + quant[1:]) / 2.0
+    return quant[np.searchsorted(mids, value, side='right')]
 
 
 class Audio(multiprocessing.Process):
@@ -52,6 +51,10 @@ class Audio(multiprocessing.Process):
                                       dur=self.grain_dur, dev=self.grain_dev,
                                       pitch=self.grain_pitch).out()
 
+        # x position bins, quantized against for every frame
+        bins = np.linspace(0, 1080, num=51)
+        bin_mids = (bins[:-1] + bins[1:]) / 2.0
+
         # signal ready
         self.q.put(True)
 
@@ -71,10 +74,8 @@ class Audio(multiprocessing.Process):
             self.num_grains.setValue(len(contour_info) // 3)
 
             # grain deviation from mode of quanitized x positions
-            xs = contour_info[:,0].tolist()
-            bins = np.linspace(0, 1080, num=51).tolist()
-            quantized_xs = [quantize(x, bins) for x in xs]
-            x_mode = int(mode(quantized_xs))
+            quantized_xs = quantize(contour_info[:,0], bins, bin_mids)
+            x_mode = int(mode(quantized_xs.tolist()))
             dev = x_mode / 1080
             self.grain_dev.setValue(dev)
 
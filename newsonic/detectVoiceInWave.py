@@ -1,21 +1,130 @@
 from vad import VoiceActivityDetector
+from multiprocessing import Pool, cpu_count
 import argparse
+import glob
+import hashlib
 import json
+import os
 
 def save_to_file(data, filename):
     with open(filename, 'w') as fp:
         json.dump(data, fp)
 
+def parameters_key(parameters):
+    return json.dumps(parameters, sort_keys=True)
+
+def file_hash(filename, block_size=1 << 20):
+    sha1 = hashlib.sha1()
+    with open(filename, 'rb') as fp:
+        for block in iter(lambda: fp.read(block_size), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+def find_wave_files(inputs):
+    """ Expands directories (recursively) and glob patterns to a sorted list of wave files. """
+    filenames = set()
+    for path in inputs:
+        if os.path.isdir(path):
+            filenames.update(glob.glob(os.path.join(path, '**', '*.wav'), recursive=True))
+        else:
+            filenames.update(glob.glob(path, recursive=True))
+    return sorted(filenames)
+
+def load_index(index_filename):
+    """ Returns the (hash, parameters) pairs that already have results in the index. """
+    done = set()
+    if os.path.exists(index_filename):
+        with open(index_filename) as fp:
+            for line in fp:
+                if line.strip():
+                    entry = json.loads(line)
+                    done.add((entry['sha1'], parameters_key(entry['parameters'])))
+    return done
+
+_done = set()
+
+def _init_worker(done):
+    global _done
+    _done = done
+
+def detect_file(job):
+    """ Returns the index entry of one file, None if it already has results, or an
+    entry with an 'error' instead of results if it could not be read or analysed.
+    """
+    filename, parameters = job
+    try:
+        sha1 = file_hash(filename)
+        v = VoiceActivityDetector(filename, mmap=True)
+        for name, value in parameters.items():
+            setattr(v, name, value)
+        if (sha1, parameters_key(v.parameters())) in _done:
+            return None
+        raw_detection = v.detect_speech()
+    except Exception as e:
+        return {'file': filename, 'error': '{}: {}'.format(type(e).__name__, e)}
+    return {
+        'file': filename,
+        'sha1': sha1,
+        'parameters': v.parameters(),
+        'speech': v.convert_windows_to_readible_labels(raw_detection),
+    }
+
+def run_batch(inputs, index_filename, parameters, workers=None):
+    """ Detects speech in every wave file found in inputs, appending one JSON line per
+    file to index_filename. Files whose content was already analysed with the same
+    parameters are skipped. Files that fail are reported and left out of the index, so
+    they are retried on the next run.
+    """
+    filenames = find_wave_files(inputs)
+    done = load_index(index_filename)
+    jobs = [(filename, parameters) for filename in filenames]
+    analysed = 0
+    failed = []
+    with Pool(workers or cpu_count(), initializer=_init_worker, initargs=(done,)) as pool, \
+            open(index_filename, 'a') as fp:
+        for entry in pool.imap_unordered(detect_file, jobs):
+            if entry is None:
+                continue
+            if 'error' in entry:
+                failed.append(entry)
+                continue
+            fp.write(json.dumps(entry) + '\n')
+            fp.flush()
+            analysed += 1
+    print("Analysed {} of {} files, {} failed, the rest already had results.".format(
+        analysed, len(filenames), len(failed)))
+    for entry in sorted(failed, key=lambda entry: entry['file']):
+        print("  {}: {}".format(entry['file'], entry['error']))
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Analyze input wave-file and save detected speech interval to json file.')
-    parser.add_argument('inputfile', metavar='INPUTWAVE',
-                        help='the full path to input wave file')
-    parser.add_argument('outputfile', metavar='OUTPUTFILE',
-                        help='the full path to output json file to save detected speech intervals')
+    parser.add_argument('paths', metavar='PATH', nargs='+',
+                        help='the full path to input wave file and to output json file, or with --index the wave files, directories or globs to analyze')
+    parser.add_argument('--index', metavar='INDEXFILE',
+                        help='batch mode: JSON Lines file collecting the detected speech intervals of every input')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='number of worker processes in batch mode, defaults to the number of cores')
+    parser.add_argument('--threshold', type=float, dest='speech_energy_threshold',
+                        help='fraction of energy in the voice band that counts as speech')
+    parser.add_argument('--start-band', type=float, dest='speech_start_band',
+                        help='lower edge of the voice band in Hz')
+    parser.add_argument('--end-band', type=float, dest='speech_end_band',
+                        help='upper edge of the voice band in Hz')
     args = parser.parse_args()
-    
-    v = VoiceActivityDetector(args.inputfile)
-    raw_detection = v.detect_speech()
-    speech_labels = v.convert_windows_to_readible_labels(raw_detection)
-    
-    save_to_file(speech_labels, args.outputfile)
+    parameters = {name: getattr(args, name)
+                  for name in ('speech_energy_threshold', 'speech_start_band', 'speech_end_band')
+                  if getattr(args, name) is not None}
+
+    if args.index:
+        run_batch(args.paths, args.index, parameters, args.workers)
+    else:
+        if len(args.paths) != 2:
+            parser.error('expected an input wave file and an output json file')
+        inputfile, outputfile = args.paths
+        v = VoiceActivityDetector(inputfile)
+        for name, value in parameters.items():
+            setattr(v, name, value)
+        raw_detection = v.detect_speech()
+        speech_labels = v.convert_windows_to_readible_labels(raw_detection)
+        
+        save_to_file(speech_labels, outputfile)
@@ -1,10 +1,10 @@
 import time
-from pyo import Input, savefileFromTable
+import numpy as np
+from pyo import Input, NewTable, TableFill, Pattern, savefileFromTable
 from pyo_client import PyoClient
 from audio_recorder import AudioRecorder
-from vad import VoiceActivityDetector
-from pydub import AudioSegment
-from pydub.playback import play
+from vad import VoiceActivityDetector, StreamingVoiceActivityDetector
+from voice_extractor import VoiceExtractor
 
 class Listener:
     def __init__(self):
@@ -12,6 +12,9 @@ class Listener:
         self.input = Input(0)
         self.sr = 44100
         self.recorder = AudioRecorder(self.input, self.sr)
+        self.stream_vad = None
+        self.stream_fill = None
+        self.stream_poller = None
 
     def listen(self, length=4, callback=lambda: print("no callback")):
         def cb():
@@ -21,32 +24,62 @@ class Listener:
         print(f"Recording for {length}s...")
         self.recorder.record(length=length)
         
-    def detect_vad(self):
-        self.recorder.record_table.save("audio.wav")
-        v = VoiceActivityDetector("audio.wav")
-        timestamps, detections = list(zip(*[(d[0] / self.sr, bool(d[1]))
-                                 for d in v.detect_speech()]))
+    def listen_stream(self, on_speech_begin=None, on_speech_end=None, buffer_length=2, poll_time=0.05):
+        """Continuously runs voice activity detection on the input.
+
+        Args:
+            on_speech_begin: called with the stream time in seconds when speech starts
+            on_speech_end: called with the stream time in seconds when speech stops
+            buffer_length: length in seconds of the circular table the input is written to
+            poll_time: how often in seconds new audio is handed to the detector
+        """
+        self.stream_vad = StreamingVoiceActivityDetector(self.sr, on_speech_begin, on_speech_end)
+        self.stream_table = NewTable(buffer_length)
+        self.stream_buffer = np.asarray(self.stream_table.getBuffer())
+        self.stream_pos = 0
+        self.stream_fill = TableFill(self.input, self.stream_table)
+        self.stream_poller = Pattern(self.poll_stream, time=poll_time).play()
+
+    def poll_stream(self):
+        pos = self.stream_fill.getCurrentPos()
+        if pos >= self.stream_pos:
+            chunk = self.stream_buffer[self.stream_pos:pos]
+        else:
+            chunk = np.concatenate((self.stream_buffer[self.stream_pos:], self.stream_buffer[:pos]))
+        self.stream_pos = pos
+        self.stream_vad.process(chunk)
+
+    def stop_stream(self):
+        if self.stream_poller:
+            self.stream_poller.stop()
+            self.stream_fill.stop()
+            self.stream_vad.flush()
+            self.stream_poller = None
+
+    def detect_vad(self, audio=None):
+        """Runs voice activity detection on the recording, or on audio if given.
+
+        Args:
+            audio: a NumPy array at self.sr or a pyo table, defaults to the recorder's table
+        """
+        if audio is None:
+            audio = self.recorder.record_table
+        v = VoiceActivityDetector(audio, self.sr)
+        detected_windows = v.detect_speech()
+        timestamps = detected_windows[:,0] / v.rate
+        detections = detected_windows[:,1] == 1.0
         return timestamps, detections
 
-    def extract_voice(self, timestamps, detections):
-        master = AudioSegment.from_file("audio.wav", format="wav")
-        output = AudioSegment.empty()
-        speech_segments = []
-
-        prev_detection = False
-        segment_start = 0
-        for i in range(len(timestamps)):
-            if not prev_detection and detections[i]:
-                segment_start = timestamps[i]
-            
-            if prev_detection and not detections[i]:
-                speech_segment = master[int(segment_start * 1000):int(timestamps[i] * 1000)]
-                speech_segments.append(speech_segment)
-            
-            prev_detection = detections[i]
-
-        for s in speech_segments:
-            output += s
-            output += AudioSegment.silent(duration=1000, frame_rate=44100)
-
-        output.export("output.wav", format="wav")
\ No newline at end of file
+    def extract_voice(self, timestamps, detections, audio=None, segment_filename=None):
+        """Writes the detected speech to output.wav, separated by a second of silence.
+
+        Args:
+            audio: a NumPy array at self.sr or a pyo table, defaults to the recorder's table
+            segment_filename: optional format string, e.g. "segment_{}.wav", to also write
+                each speech segment to its own file
+        """
+        if audio is None:
+            audio = self.recorder.record_table
+        extractor = VoiceExtractor(audio, self.sr)
+        starts, ends = extractor.boundaries(timestamps, detections)
+        extractor.write("output.wav", starts, ends, segment_filename=segment_filename)
@@ -1,157 +1,450 @@
+import json
 import numpy as np
 import scipy.io.wavfile as wf
+from scipy.ndimage import median_filter
 import matplotlib.pyplot as plt
 
 class VoiceActivityDetector():
     """ Use signal energy to detect voice activity in wav file """
     
-    def __init__(self, wave_input_filename):
-        self._read_wav(wave_input_filename)._convert_to_mono()
+    # Per-frame features that can be computed from one batched spectrum
+    FEATURES = ('band_ratio', 'flatness', 'zcr', 'rms')
+    
+    def __init__(self, wave_input, rate=None, mmap=False):
+        """ wave_input is a wav filename, a NumPy array of samples at the given
+        rate, or a pyo table whose buffer is analysed in place at its own rate.
+        With mmap a wav file is memory-mapped instead of read into memory and
+        is analysed in blocks, so memory use does not grow with file length.
+        """
+        self.mmap = mmap
+        if isinstance(wave_input, str):
+            self._read_wav(wave_input, mmap)
+        elif hasattr(wave_input, 'getBuffer'):
+            self._read_table(wave_input)
+        else:
+            self._read_array(wave_input, rate)
+        if not mmap:
+            self._convert_to_mono()
+        self._set_parameters()
+    
+    def _set_parameters(self):
         self.sample_window = 0.02 #20 ms
         self.sample_overlap = 0.01 #10ms
         self.speech_window = 0.5 #half a second
         self.speech_energy_threshold = 0.4 #40% of energy in voice band
         self.speech_start_band = 300
         self.speech_end_band = 3000
+        self.features = ('band_ratio',) #any of FEATURES, computed in one pass per frame
+        self.speech_rule = None #callable taking the feature array, returning speech flags
+        self.frames_per_block = 4096 #windows per batched FFT
+        self.block_length = 60 #seconds of audio per block when analysing in blocks
+        self._detection_cache = None
+        return self
            
-    def _read_wav(self, wave_file):
-        self.rate, self.data = wf.read(wave_file)
+    def parameters(self):
+        """ Returns the settings that affect detection results. """
+        return {
+            'sample_window': self.sample_window,
+            'sample_overlap': self.sample_overlap,
+            'speech_window': self.speech_window,
+            'speech_energy_threshold': self.speech_energy_threshold,
+            'speech_start_band': self.speech_start_band,
+            'speech_end_band': self.speech_end_band,
+            'features': list(self.features),
+        }
+    
+    def _read_wav(self, wave_file, mmap=False):
+        self.rate, self.data = wf.read(wave_file, mmap=mmap)
         self.channels = len(self.data.shape)
         self.filename = wave_file
         return self
     
+    def _read_table(self, table):
+        self.rate = int(table.getSamplingRate())
+        self.data = np.asarray(table.getBuffer())
+        self.channels = 1
+        self.filename = None
+        return self
+    
+    def _read_array(self, data, rate):
+        assert rate is not None, "Sampling rate is required for array input."
+        self.rate = rate
+        self.data = np.asarray(data)
+        self.channels = len(self.data.shape)
+        self.filename = None
+        return self
+    
     def _convert_to_mono(self):
         if self.channels == 2 :
-            self.data = np.mean(self.data, axis=1, dtype=self.data.dtype)
+            self.data = self._mix_to_mono(self.data)
             self.channels = 1
         return self
     
-    def _calculate_frequencies(self, audio_data):
-        data_freq = np.fft.fftfreq(len(audio_data),1.0/self.rate)
+    def _mix_to_mono(self, data):
+        if data.shape[1] != 2:
+            return np.mean(data, axis=1, dtype=data.dtype)
+        # Same result as the mean in data.dtype, without a slow reduction along rows
+        mono = np.add(data[:,0], data[:,1])
+        return np.true_divide(mono, 2, out=mono, casting='unsafe')
+    
+    def _frame_data(self, data, sample_window, sample_overlap):
+        """ Returns a zero-copy (n_frames, sample_window) view of data, one row
+        per analysis window, stepping sample_overlap samples between rows.
+        """
+        if len(data) <= sample_window:
+            return np.empty((0, sample_window), dtype=data.dtype)
+        n_frames = (len(data) - sample_window - 1) // sample_overlap + 1
+        return np.lib.stride_tricks.as_strided(
+            data, shape=(n_frames, sample_window),
+            strides=(data.strides[0] * sample_overlap, data.strides[0]),
+            writeable=False)
+    
+    def _calculate_band_mask(self, sample_window):
+        data_freq = np.fft.rfftfreq(sample_window, 1.0/self.rate)
         data_freq = data_freq[1:]
-        return data_freq    
+        band_mask = (self.speech_start_band < data_freq) & (data_freq < self.speech_end_band)
+        return band_mask.astype(np.float64)
     
-    def _calculate_amplitude(self, audio_data):
-        data_ampl = np.abs(np.fft.fft(audio_data))
-        data_ampl = data_ampl[1:]
-        return data_ampl
-        
-    def _calculate_energy(self, data):
-        data_amplitude = self._calculate_amplitude(data)
-        data_energy = data_amplitude ** 2
-        return data_energy
-        
-    def _znormalize_energy(self, data_energy):
-        energy_mean = np.mean(data_energy)
-        energy_std = np.std(data_energy)
-        energy_znorm = (data_energy - energy_mean) / energy_std
-        return energy_znorm
-    
-    def _connect_energy_with_frequencies(self, data_freq, data_energy):
-        energy_freq = {}
-        for (i, freq) in enumerate(data_freq):
-            if abs(freq) not in energy_freq:
-                energy_freq[abs(freq)] = data_energy[i] * 2
-        return energy_freq
-    
-    def _calculate_normalized_energy(self, data):
-        data_freq = self._calculate_frequencies(data)
-        data_energy = self._calculate_energy(data)
-        #data_energy = self._znormalize_energy(data_energy) #znorm brings worse results
-        energy_freq = self._connect_energy_with_frequencies(data_freq, data_energy)
-        return energy_freq
-    
-    def _sum_energy_in_band(self,energy_frequencies, start_band, end_band):
-        sum_energy = 0
-        for f in energy_frequencies.keys():
-            if start_band<f<end_band:
-                sum_energy += energy_frequencies[f]
-        return sum_energy
+    def _detect_speech_in_frames(self, frames, band_mask):
+        """ Output is the speech flag and the structured array of features of
+        every frame, so the features are only computed once.
+        """
+        names = self._required_features()
+        flags = np.empty(len(frames), dtype=bool)
+        features = np.empty(len(frames), dtype=self._features_dtype(names))
+        # Frames are analysed in blocks so the spectrum of a long file is never held at once
+        for block_start in range(0, len(frames), self.frames_per_block):
+            block = slice(block_start, block_start + self.frames_per_block)
+            features[block] = self._calculate_features(frames[block], band_mask, names)
+            flags[block] = self._apply_speech_rule(features[block])
+        return flags, features
+    
+    def _features_dtype(self, names):
+        return [(name, np.float64) for name in self.FEATURES if name in names]
+    
+    def _required_features(self):
+        if self.speech_rule is None:
+            return tuple(self.features) + ('band_ratio',)
+        return tuple(self.features)
+    
+    def _apply_speech_rule(self, features):
+        if self.speech_rule is not None:
+            return np.asarray(self.speech_rule(features), dtype=bool)
+        # Hipothesis is that when there is a speech sequence we have ratio of energies more than Threshold
+        return features['band_ratio']>self.speech_energy_threshold
+    
+    def _calculate_features(self, frames, band_mask, names):
+        """ Computes the named features of every frame from a single spectrum.
+        Output is structured array with one field per feature.
+        """
+        features = np.empty(len(frames), dtype=self._features_dtype(names))
+        names = features.dtype.names
+        if 'band_ratio' in names or 'flatness' in names:
+            data_ampl = np.abs(np.fft.rfft(frames, axis=1))
+            data_energy = data_ampl[:, 1:] ** 2
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if 'band_ratio' in names:
+                sum_voice_energy = data_energy @ band_mask
+                sum_full_energy = data_energy.sum(axis=1)
+                features['band_ratio'] = sum_voice_energy / sum_full_energy
+            if 'flatness' in names:
+                # Geometric over arithmetic mean of the power spectrum, 1 for white noise
+                geometric_mean = np.exp(np.log(data_energy).mean(axis=1))
+                features['flatness'] = geometric_mean / data_energy.mean(axis=1)
+        if 'zcr' in names:
+            sign_changes = np.count_nonzero(np.diff(np.signbit(frames), axis=1), axis=1)
+            features['zcr'] = sign_changes / (frames.shape[1] - 1)
+        if 'rms' in names:
+            features['rms'] = np.sqrt(np.mean(np.square(frames, dtype=np.float64), axis=1))
+        return features
     
     def _median_filter (self, x, k):
         assert k % 2 == 1, "Median filter length must be odd."
         assert x.ndim == 1, "Input must be one-dimensional."
+        if np.all((x == 0) | (x == 1)):
+            return self._binary_median_filter(x, k)
+        # Edges are padded with the first and last values
+        return median_filter(x, size=k, mode='nearest').astype(np.float64)
+    
+    def _binary_median_filter(self, x, k):
+        """ O(n) median filter for 0/1 flags, with the first and last flags
+        repeated past the edges.
+        """
         k2 = (k - 1) // 2
-        y = np.zeros ((len (x), k), dtype=x.dtype)
-        y[:,k2] = x
-        for i in range (k2):
-            j = k2 - i
-            y[j:,i] = x[:-j]
-            y[:j,i] = x[0]
-            y[:-j,-(i+1)] = x[j:]
-            y[-j:,-(i+1)] = x[-1]
-        return np.median (y, axis=1)
-        
-    def _smooth_speech_detection(self, detected_windows):
+        padded = np.pad(x, k2, mode='edge')
+        return self._majority_vote(padded, k).astype(np.float64)
+    
+    def _majority_vote(self, flags, k):
+        """ Median of every complete length k window of 0/1 flags, which is a
+        majority vote read off a cumulative sum.
+        """
+        votes = np.concatenate(([0], np.cumsum(flags)))
+        return (votes[k:] - votes[:-k]) > (k - 1) // 2
+    
+    def _median_window(self):
         median_window=int(self.speech_window/self.sample_window)
         if median_window%2==0: median_window=median_window-1
-        median_energy = self._median_filter(detected_windows[:,1], median_window)
+        return median_window
+    
+    def _smooth_speech_detection(self, detected_windows):
+        median_energy = self._median_filter(detected_windows[:,1], self._median_window())
         return median_energy
         
+    def detect_speech_intervals(self, detected_windows):
+        """ Takes as input array of window numbers and speech flags from speech
+        detection and finds the intervals of speech.
+        Output is structured array with begin_sample, end_sample, speech_begin
+        and speech_end (seconds) fields, one row per interval. Speech still
+        going on at the last window ends where that window ends.
+        """
+        sample_window = int(self.rate * self.sample_window)
+        window_starts = detected_windows[:,0].astype(np.int64)
+        # The window after the last one starts where the last one ends
+        boundaries = np.append(window_starts, window_starts[-1:] + sample_window)
+        flags = np.concatenate(([0], detected_windows[:,1] == 1.0, [0])).astype(np.int8)
+        edges = np.diff(flags)
+        intervals = np.empty(np.count_nonzero(edges == 1), dtype=[
+            ('begin_sample', np.int64), ('end_sample', np.int64),
+            ('speech_begin', np.float64), ('speech_end', np.float64)])
+        intervals['begin_sample'] = boundaries[np.flatnonzero(edges == 1)]
+        intervals['end_sample'] = boundaries[np.flatnonzero(edges == -1)]
+        intervals['speech_begin'] = intervals['begin_sample'] / self.rate
+        intervals['speech_end'] = intervals['end_sample'] / self.rate
+        return intervals
+    
+    def intervals_to_labels(self, intervals):
+        """ Converts speech intervals to a list of dictionaries with speech_begin
+        and speech_end in seconds.
+        """
+        return [{'speech_begin': float(begin), 'speech_end': float(end)}
+                for begin, end in zip(intervals['speech_begin'], intervals['speech_end'])]
+    
+    def intervals_to_json(self, intervals):
+        return json.dumps(self.intervals_to_labels(intervals))
+    
     def convert_windows_to_readible_labels(self, detected_windows):
         """ Takes as input array of window numbers and speech flags from speech
         detection and convert speech flags to time intervals of speech.
         Output is array of dictionaries with speech intervals.
         """
-        speech_time = []
-        is_speech = 0
-        for window in detected_windows:
-            if (window[1]==1.0 and is_speech==0): 
-                is_speech = 1
-                speech_label = {}
-                speech_time_start = window[0] / self.rate
-                speech_label['speech_begin'] = speech_time_start
-                print(window[0], speech_time_start)
-                #speech_time.append(speech_label)
-            if (window[1]==0.0 and is_speech==1):
-                is_speech = 0
-                speech_time_end = window[0] / self.rate
-                speech_label['speech_end'] = speech_time_end
-                speech_time.append(speech_label)
-                print(window[0], speech_time_end)
-        return speech_time
+        return self.intervals_to_labels(self.detect_speech_intervals(detected_windows))
       
-    def plot_detected_speech_regions(self):
-        """ Performs speech detection and plot original signal and speech regions.
+    def plot_detected_speech_regions(self, width=2000):
+        """ Plots original signal and speech regions, reusing the last speech
+        detection when the parameters have not changed. Both signals are
+        drawn as min/max envelopes of width points, reduced block_length
+        seconds at a time, so long files plot quickly in bounded memory.
         """
-        data = self.data
         detected_windows = self.detect_speech()
-        data_speech = np.zeros(len(data))
-        it = np.nditer(detected_windows[:,0], flags=['f_index'])
-        while not it.finished:
-            data_speech[int(it[0])] = data[int(it[0])] * detected_windows[it.index,1]
-            it.iternext()
+        positions, envelopes = self._speech_envelopes(detected_windows, width)
         plt.figure()
-        plt.plot(data_speech)
-        plt.plot(data)
+        for minimums, maximums in envelopes:
+            plt.fill_between(positions, minimums, maximums, step='post')
         plt.show()
         return self
+    
+    def _speech_envelopes(self, detected_windows, width):
+        """ Reduces the signal and the signal masked by the speech flags to the
+        minimum and maximum of width equal bins, one block at a time.
+        Output is the first sample of each bin and the (minimums, maximums) of
+        the signal and of the speech.
+        """
+        n_samples = len(self.data)
+        bin_size = max(int(np.ceil(n_samples / width)), 1)
+        n_bins = int(np.ceil(n_samples / bin_size))
+        sample_overlap = int(self.rate * self.sample_overlap)
+        flags = detected_windows[:,1] == 1.0
+        envelopes = np.zeros((2, 2, n_bins), dtype=np.float64)
+        # Blocks hold whole bins, so no bin straddles two blocks
+        block_bins = max(int(self.block_length * self.rate) // bin_size, 1)
+        for first_bin in range(0, n_bins, block_bins):
+            start = first_bin * bin_size
+            block = self.data[start:start + block_bins * bin_size]
+            if block.ndim == 2:
+                block = self._mix_to_mono(block)
+            # Each sample takes the flag of the last window starting at or before it
+            first_window = start // sample_overlap
+            block_flags = flags[first_window:(start + len(block) - 1) // sample_overlap + 1]
+            speech = np.zeros(len(block), dtype=bool)
+            window_speech = np.repeat(block_flags, sample_overlap)[start - first_window * sample_overlap:][:len(block)]
+            speech[:len(window_speech)] = window_speech
+            bins = slice(first_bin, first_bin + block_bins)
+            for envelope, signal in zip(envelopes, (block, np.where(speech, block, 0))):
+                envelope[0, bins], envelope[1, bins] = self._minmax_bins(signal, bin_size)
+        return np.arange(n_bins) * bin_size, envelopes
+    
+    def _minmax_bins(self, data, bin_size):
+        """ Output is the minimum and maximum of every bin_size samples of data,
+        the last bin holding what is left.
+        """
+        n_full = len(data) // bin_size * bin_size
+        bins = data[:n_full].reshape(-1, bin_size)
+        minimums, maximums = bins.min(axis=1), bins.max(axis=1)
+        if n_full < len(data):
+            minimums = np.append(minimums, data[n_full:].min())
+            maximums = np.append(maximums, data[n_full:].max())
+        return minimums, maximums
        
+    def analyze_frames(self):
+        """ Returns the selected features of every analysis window.
+        Output is structured array with a sample_start field followed by one
+        field per name in self.features. The features come from the same pass
+        as detect_speech and are cached with its result.
+        """
+        self.detect_speech()
+        return self._detection_cache[2]
+    
     def detect_speech(self):
         """ Detects speech regions based on ratio between speech band energy
         and total energy.
         Output is array of window numbers and speech flags (1 - speech, 0 - nonspeech).
+        The result is cached until the parameters change.
+        """
+        key = (json.dumps(self.parameters(), sort_keys=True), self.speech_rule)
+        if self._detection_cache is None or self._detection_cache[0] != key:
+            self._detection_cache = (key,) + self._detect_speech()
+        return self._detection_cache[1]
+    
+    def _detect_speech(self):
+        """ Output is the detect_speech result and the analyze_frames result. """
+        sample_overlap = int(self.rate * self.sample_overlap)
+        if self.mmap:
+            features = []
+            blocks = list(self.iter_detect_speech(features))
+            detected_windows = np.concatenate(blocks) if blocks else np.empty((0, 2))
+            features = np.concatenate(features) if features else \
+                np.empty(0, dtype=self._features_dtype(self._required_features()))
+            return detected_windows, self._frame_analysis(features, sample_overlap)
+        sample_window = int(self.rate * self.sample_window)
+        frames = self._frame_data(self.data, sample_window, sample_overlap)
+        flags, features = self._detect_speech_in_frames(frames, self._calculate_band_mask(sample_window))
+        detected_windows = np.empty((len(frames), 2))
+        detected_windows[:,0] = np.arange(len(frames)) * sample_overlap
+        detected_windows[:,1] = flags
+        if len(detected_windows):
+            detected_windows[:,1] = self._smooth_speech_detection(detected_windows)
+        return detected_windows, self._frame_analysis(features, sample_overlap)
+    
+    def _frame_analysis(self, features, sample_overlap):
+        names = [name for name in self.FEATURES if name in self.features]
+        analysis = np.empty(len(features), dtype=[('sample_start', np.int64)] + self._features_dtype(names))
+        analysis['sample_start'] = np.arange(len(features)) * sample_overlap
+        for name in names:
+            analysis[name] = features[name]
+        return analysis
+    
+    def iter_detect_speech(self, features=None):
+        """ Same output as detect_speech, yielded in pieces while the audio is read
+        block_length seconds at a time. Windows spanning a block edge and the
+        smoothing context around it are carried over, so the pieces concatenate
+        to exactly the detect_speech result while memory stays bounded by the
+        block size. If features is a list, the unsmoothed features of the windows
+        of every block are appended to it.
+        """
+        stream = StreamingVoiceActivityDetector(self.rate)
+        for name, value in self.parameters().items():
+            setattr(stream, name, value)
+        stream.speech_rule = self.speech_rule
+        stream.frames_per_block = self.frames_per_block
+        block_samples = int(self.block_length * self.rate)
+        for block_start in range(0, len(self.data), block_samples):
+            detected_windows = stream.process(self.data[block_start:block_start + block_samples])
+            if features is not None:
+                features.append(stream.frame_features)
+            if len(detected_windows):
+                yield detected_windows
+        detected_windows = stream.flush()
+        if len(detected_windows):
+            yield detected_windows
+
+
+class StreamingVoiceActivityDetector(VoiceActivityDetector):
+    """ Incremental voice activity detection over successive chunks of live audio """
+    
+    def __init__(self, rate, on_speech_begin=None, on_speech_end=None):
+        """ on_speech_begin and on_speech_end are called with the time in seconds
+        of the window where speech starts or stops, as soon as it is known.
+        Smoothing looks ahead (k - 1) // 2 windows, k being the median window of
+        speech_window / sample_window windows, and windows start every sample_overlap.
+        An event is therefore known (k - 1) // 2 * sample_overlap + sample_window after
+        the start of its window, 12 * 10 ms + 20 ms = 140 ms with the defaults, plus
+        the time the chunk completing that audio takes to arrive.
+        """
+        self.rate = rate
+        self.channels = 1
+        self.mmap = False
+        self._set_parameters()
+        self.on_speech_begin = on_speech_begin
+        self.on_speech_end = on_speech_end
+        self.reset()
+    
+    def reset(self):
+        self._tail = np.empty(0)
+        self.frame_features = None  # Features of the windows completed by the last chunk
+        self._pending_flags = None
+        self._windows_emitted = 0
+        self.is_speech = False
+        return self
+    
+    def process(self, chunk):
+        """ Consumes the next chunk of audio samples (mono, or 2 channels in columns).
+        Output is array of window numbers and smoothed speech flags for every
+        window that could be finalized with this chunk.
         """
-        detected_windows = np.array([])
+        chunk = np.asarray(chunk)
+        if chunk.ndim == 2:
+            chunk = self._mix_to_mono(chunk)
         sample_window = int(self.rate * self.sample_window)
         sample_overlap = int(self.rate * self.sample_overlap)
-        data = self.data
-        sample_start = 0
-        start_band = self.speech_start_band
-        end_band = self.speech_end_band
-        while (sample_start < (len(data) - sample_window)):
-            sample_end = sample_start + sample_window
-            if sample_end>=len(data): sample_end = len(data)-1
-            data_window = data[sample_start:sample_end]
-            energy_freq = self._calculate_normalized_energy(data_window)
-            sum_voice_energy = self._sum_energy_in_band(energy_freq, start_band, end_band)
-            sum_full_energy = sum(energy_freq.values())
-            speech_ratio = sum_voice_energy/sum_full_energy
-            # Hipothesis is that when there is a speech sequence we have ratio of energies more than Threshold
-            speech_ratio = speech_ratio>self.speech_energy_threshold
-            detected_windows = np.append(detected_windows,[sample_start, speech_ratio])
-            sample_start += sample_overlap
-        detected_windows = detected_windows.reshape(int(len(detected_windows)/2),2)
-        detected_windows[:,1] = self._smooth_speech_detection(detected_windows)
+        data = np.concatenate((self._tail, chunk))
+        frames = self._frame_data(data, sample_window, sample_overlap)
+        flags, self.frame_features = self._detect_speech_in_frames(frames, self._calculate_band_mask(sample_window))
+        # Keep the samples the next window still needs, the rest of the chunk is done
+        self._tail = data[len(frames) * sample_overlap:].copy()
+        return self._smooth_incrementally(flags.astype(np.float64), final=False)
+    
+    def flush(self):
+        """ Finalizes the windows still waiting on smoothing lookahead at the end of
+        the stream, closing any open speech region.
+        """
+        detected_windows = self._smooth_incrementally(np.empty(0), final=True)
+        if self.is_speech:
+            self.is_speech = False
+            sample_window = int(self.rate * self.sample_window)
+            sample_overlap = int(self.rate * self.sample_overlap)
+            end = (self._windows_emitted - 1) * sample_overlap + sample_window
+            if self.on_speech_end:
+                self.on_speech_end(end / self.rate)
+        self.reset()
+        return detected_windows
+    
+    def _smooth_incrementally(self, flags, final):
+        median_window = self._median_window()
+        k2 = (median_window - 1) // 2
+        if self._pending_flags is None:
+            if not len(flags):
+                return np.empty((0, 2))
+            # Same edge padding as the batch median filter
+            self._pending_flags = np.full(k2, flags[0])
+        pending = np.concatenate((self._pending_flags, flags))
+        if final:
+            pending = np.concatenate((pending, np.full(k2, pending[-1])))
+        smoothed = self._majority_vote(pending, median_window)
+        n_ready = len(smoothed)
+        self._pending_flags = pending[n_ready:]
+        
+        sample_overlap = int(self.rate * self.sample_overlap)
+        detected_windows = np.empty((n_ready, 2))
+        detected_windows[:,0] = (self._windows_emitted + np.arange(n_ready)) * sample_overlap
+        detected_windows[:,1] = smoothed
+        self._windows_emitted += n_ready
+        self._emit_events(detected_windows)
         return detected_windows
- 
+    
+    def _emit_events(self, detected_windows):
+        flags = np.concatenate(([self.is_speech], detected_windows[:,1] == 1.0))
+        for i in np.flatnonzero(np.diff(flags.astype(np.int8))):
+            self.is_speech = bool(flags[i + 1])
+            callback = self.on_speech_begin if self.is_speech else self.on_speech_end
+            if callback:
+                callback(float(detected_windows[i,0] / self.rate))
@@ -0,0 +1,90 @@
+import wave
+import numpy as np
+
+
+class VoiceExtractor:
+    def __init__(self, audio, sr, silence=1.0):
+        """Cuts detected speech out of a recording and joins it with silence in between.
+
+        Args:
+            audio: a mono NumPy array, float in [-1, 1] or integer PCM, or a pyo table, used in place
+            sr: the sampling rate of audio
+            silence: seconds of silence written after each speech segment
+        """
+        if hasattr(audio, 'getBuffer'):
+            audio = np.asarray(audio.getBuffer())
+        self.audio = np.asarray(audio)
+        self.sr = sr
+        self.silence = silence
+
+    def boundaries(self, timestamps, detections):
+        """Returns the start and end samples of every speech segment.
+
+        Args:
+            timestamps: window start times in seconds
+            detections: speech flag of each window
+
+        A segment still open at the last window runs to the end of the audio.
+        """
+        detections = np.asarray(detections, dtype=bool)
+        samples = np.round(np.asarray(timestamps) * self.sr).astype(np.int64)
+        previous = np.concatenate(([False], detections[:-1]))
+        starts = samples[detections & ~previous]
+        ends = samples[~detections & previous]
+        if len(detections) and detections[-1]:
+            ends = np.append(ends, len(self.audio))
+        return starts, ends
+
+    def segments(self, starts, ends):
+        """Returns views of the audio for each speech segment."""
+        return [self.audio[start:end] for start, end in zip(starts, ends)]
+
+    def extract(self, starts, ends):
+        """Returns the speech segments joined with silence, in a single preallocated array."""
+        gap = int(self.silence * self.sr)
+        lengths = np.asarray(ends) - np.asarray(starts)
+        output = np.zeros(int(lengths.sum()) + gap * len(lengths), dtype=self.audio.dtype)
+        offsets = np.concatenate(([0], np.cumsum(lengths + gap)[:-1]))
+        for offset, segment in zip(offsets, self.segments(starts, ends)):
+            output[offset:offset + len(segment)] = segment
+        return output
+
+    def write(self, filename, starts, ends, segment_filename=None):
+        """Streams the speech segments joined with silence to a 16 bit wav file.
+
+        Args:
+            filename: path of the joined output
+            starts: start samples of the segments
+            ends: end samples of the segments
+            segment_filename: optional format string, e.g. "segment_{}.wav", to also
+                write each segment to its own file in the same pass
+        """
+        silence = bytes(2 * int(self.silence * self.sr))
+        with self._open_wav(filename) as output:
+            for i, segment in enumerate(self.segments(starts, ends)):
+                pcm = self._to_pcm(segment)
+                output.writeframes(pcm)
+                output.writeframes(silence)
+                if segment_filename:
+                    with self._open_wav(segment_filename.format(i)) as segment_output:
+                        segment_output.writeframes(pcm)
+
+    def _open_wav(self, filename):
+        output = wave.open(filename, 'wb')
+        output.setnchannels(1)
+        output.setsampwidth(2)
+        output.setframerate(int(self.sr))
+        return output
+
+    def _to_pcm(self, segment):
+        """Converts floats in [-1, 1], or integer PCM of any width, to 16 bit little-endian bytes."""
+        if segment.dtype == np.uint8:
+            # 8 bit wav is unsigned, centred on 128
+            segment = ((segment.astype(np.int16) - 128) << 8).astype(np.int16)
+        elif np.issubdtype(segment.dtype, np.integer) and segment.dtype.itemsize > 2:
+            segment = (segment >> (8 * (segment.dtype.itemsize - 2))).astype(np.int16)
+        elif np.issubdtype(segment.dtype, np.floating):
+            segment = (np.clip(segment, -1.0, 1.0) * 32767).astype(np.int16)
+        elif segment.dtype.kind != 'i' or segment.dtype.itemsize != 2:
+            raise ValueError("Unsupported sample type {}".format(segment.dtype))
+        return segment.astype('<i2', copy=False).tobytes()
@@ -9,13 +9,19 @@ sys.path.insert(1, os.path.join(sys.path[0], '..'))
 from pyo_extensions.pyo_client import PyoClient
 from pyo_extensions.metronome import Metronome
 from pyo_extensions.audio_recorder import AudioRecorder
+from pyo_extensions.sample import Sample
 from communication.serial_client import SerialClient
 
 
 class Looper:
     """Implements live loop recording and playback."""
 
-    def __init__(self):
+    def __init__(self, hub=None):
+        """
+        Args:
+            hub (RecorderHub, optional): Hub to record the input through, shared with other recorders.
+                Defaults to None, recording from input 0.
+        """
         self.tempo = 100
         self.tempo_seconds = 1 / (self.tempo / 60)
         self.num_beats = 8
@@ -24,6 +30,7 @@ class Looper:
         self.start_recording = False
         self.recording = False
         self.saved_recordings = []
+        self.max_saved_recordings = 8  # Older recordings return their tables to the recorder's pool
         self.playing_recording = None
 
         self.serial_client = None
@@ -35,9 +42,9 @@ class Looper:
         threading.Thread(target=self.on_metro).start()
 
         self.pyo = PyoClient(prompt_for_audio_devices=True)
-        self.input = Input(0)
+        self.input = hub.input if hub else Input(0)
         self.audio_recording_object = AudioRecorder(
-            self.input, self.tempo_seconds * self.num_beats)
+            self.input, self.pyo.audio_server.getSamplingRate(), self.tempo_seconds * self.num_beats, hub=hub)
 
         # self.serial_client = SerialClient(arduino_params={"int_bytes": 4})  # Teensy int is 32-bit
         # self.serial_client.add_command("start_recording", "i", self.start_loop)
@@ -71,11 +78,14 @@ class Looper:
                     if self.recording:  # stop recording
                         self.recording = False
                         self.saved_recordings.append(
-                            self.audio_recording_object.get_table_copy())
+                            Sample(table=self.audio_recording_object.checkout_copy(),
+                                   length=self.audio_recording_object.get_duration()))
+                        if len(self.saved_recordings) > self.max_saved_recordings:
+                            self.audio_recording_object.pool.release(self.saved_recordings.pop(0).table)
                         if self.playing_recording:
                             self.playing_recording.stop()
-                        self.playing_recording = TableRead(self.saved_recordings[-1],
-                                                           freq=1 / self.saved_recordings[-1].length).out()
+                        self.playing_recording = self.saved_recordings[-1]
+                        self.playing_recording.play()
                         self.serial_client.send("recording", 0)
                     if self.start_recording:  # start recording
                         self.start_recording = False
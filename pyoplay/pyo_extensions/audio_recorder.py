@@ -1,8 +1,21 @@
 from pyo import *
+import os
+import time
+import wave
+import threading
+import numpy as np
+try:
+    import soundfile
+except ImportError:
+    soundfile = None
+
+from pyo_extensions.table_pool import get_default_pool
+from utils.utils import WritePositionCounter, circular_span
 
 
 class AudioRecorder:
-    def __init__(self, input_object, sr, length=4, processing=None, on_stop=None, pattern=None):
+    def __init__(self, input_object, sr, length=4, processing=None, on_stop=None, pattern=None,
+                 ring_length=None, pre_roll=0, hub=None, pool=None):
         """Wraps the recording of an input stream.
 
         Args:
@@ -10,28 +23,140 @@ class AudioRecorder:
             length: the length of the recording to be done
             processing: a function that takes an input PyoObject, and returns a processed PyoObject to record
             on_stop:
+            ring_length: if given, record continuously into a circular table holding this many seconds,
+                and have record()/stop() only bookmark positions in it
+            pre_roll: seconds before record() to include in a ring recording, which always records
+                the processing chain the ring was started with
+            hub: a RecorderHub to take the processed input and the sample counter from, in which case
+                processing is only applied when passed to a recording
+            pool: the TablePool to take recording tables from, the default pool if not given
         """
         self.input = input_object
         self.sr = sr
         self.length = length
         self.processing = processing
         self.on_stop = on_stop
-        self.ctr_trig = Trig()
-        self.ctr = Count(self.ctr_trig)
-        self.record_table = NewTable(self.length)
+        self.hub = hub
+        if self.hub:
+            self.ctr_trig = None
+            self.ctr = None
+        else:
+            self.ctr_trig = Trig()
+            self.ctr = Count(self.ctr_trig)
+        self.count_start = 0  # Hub counter value when the recording started
+        self.pool = pool or get_default_pool(self.sr)
+        # A ring recorder records into its ring table only
+        self.record_table = None if ring_length else self.pool.checkout(self.length)
+        self.take_samples = int(round(self.length * self.sr))  # Samples a full take records, the table may be longer
+        self.num_samples = self.take_samples  # Logical length of the recording
         self.pattern = pattern
         self.recording_object = None
         self.stopper = None
         self.max_length = 15
 
+        self.ring_length = ring_length
+        self.pre_roll = pre_roll
+        self.ring_table = None
+        self.ring_buffer = None
+        self.ring_fill = None
+        self.ring_poller = None
+        self.ring_counter = None  # Samples written since the ring was started
+        self.span_start = 0  # Bookmarked span of a ring recording, in samples since the ring was started
+        self.span_end = 0
+        self.ring_recording = False
+        self.end_caller = None
+        if self.ring_length:
+            self.start_ring()
+
+        self.streaming = False
+        self.stream_table = None
+        self.stream_buffer = None
+        self.stream_fill = None
+        self.stream_counter = None  # Samples written to the stream table since streaming started
+        self.stream_written = 0  # Samples drained to the file
+        self.stream_file = None
+        self.stream_writer = None
+        self.stream_thread = None
+        self.stream_stopped = threading.Event()
+        self.chunk_length = 0.5
+        self.fsync_interval = None
+        self.last_fsync = 0
+        self.stream_end_async = False  # Whether the writer thread reports the end of the take through stream_end_trig
+        self.stream_finishing = False  # A streamed take reached its length and the writer is finishing the file
+        self.stream_end_trig = Trig()
+        self.stream_end_func = TrigFunc(self.stream_end_trig, self.on_recording_end)
+
+    def start_ring(self):
+        """Starts filling the circular table, allocating it once."""
+        if self.ring_table is None:
+            self.ring_table = NewTable(self.ring_length)
+            self.ring_buffer = np.asarray(self.ring_table.getBuffer())
+        source = self.get_source()
+        self.ring_fill = TableFill(source, self.ring_table)
+        self.ring_counter = WritePositionCounter(self.ring_fill, self.ring_table.getSize())
+        # Poll the write position a few times per lap so no wrap around goes unnoticed
+        self.ring_poller = Pattern(self.ring_position, time=self.ring_length / 4).play()
+
+    def ring_position(self):
+        """Returns the number of samples written since the ring was started."""
+        return self.ring_counter.count()
+
+    def get_source(self, processing=None):
+        """Returns the signal to record, only building a processing chain when the hub does not provide one."""
+        if processing:
+            return processing(self.input)
+        if self.hub:
+            return self.hub.source
+        if self.processing:
+            return self.processing(self.input)
+        return self.input
+
+    def elapsed_samples(self):
+        """Returns the number of samples since the recording started."""
+        if self.hub:
+            return self.hub.elapsed(self.count_start)
+        return int(self.ctr.get())
+
     def set_length(self, new_length):
         self.record_table.setSize(new_length)
+        self.take_samples = self.record_table.getSize()
+        self.num_samples = self.take_samples
+
+    def get_duration(self):
+        """Returns the logical length of the recording in seconds."""
+        return self.num_samples / self.sr
 
     def get_table(self):
-        return self.record_table.getTable()
+        if self.ring_length:
+            return self.get_span().tolist()
+        return self.record_table.getTable()[:self.num_samples]
 
     def get_table_copy(self):
-        return self.record_table.copy()
+        if self.ring_length:
+            span = self.get_span()
+            table = NewTable(len(span) / self.sr)
+            np.asarray(table.getBuffer())[:len(span)] = span
+            table.refreshView()
+            return table
+        if self.num_samples == self.record_table.getSize():
+            return self.record_table.copy()
+        # Only a standalone copy is physically trimmed to the logical length
+        table = NewTable(self.get_duration())
+        np.asarray(table.getBuffer())[:] = np.asarray(self.record_table.getBuffer())[:table.getSize()]
+        table.refreshView()
+        return table
+
+    def checkout_copy(self):
+        """Returns a copy of the recording in a table from the pool, which may be longer than get_duration()
+        and should be released to the pool when no longer played."""
+        if self.ring_length:
+            audio = self.get_span()
+        else:
+            audio = np.asarray(self.record_table.getBuffer())[:self.num_samples]
+        table = self.pool.checkout(len(audio) / self.sr)
+        np.asarray(table.getBuffer())[:len(audio)] = audio
+        table.refreshView()
+        return table
 
     def on_recording_end(self):
         if self.pattern:
@@ -40,38 +165,217 @@ class AudioRecorder:
             self.on_stop()
 
     def record(self, processing=None, length=None):
+        # Any stop() from here on is for this take, not a streamed one still being finished
+        self.stream_finishing = False
+        if self.ring_length:
+            if processing:
+                raise ValueError("A ring recording records the processing chain the ring was started with.")
+            self.record_ring(length=length)
+            return
+
         if length:
-            if length <= self.max_length:
-                self.record_table = NewTable(length)
-            else:
+            if length > self.max_length:
                 print("Truncating length to maximum of {} seconds.".format(
                     self.max_length))
-                self.record_table = NewTable(self.max_length)
+                length = self.max_length
+            self.take_samples = int(round(length * self.sr))
+        if self.pool.bucket_samples(self.take_samples) != self.pool.bucket_of(self.record_table):
+            self.pool.release(self.record_table)
+            self.record_table = self.pool.checkout(self.take_samples / self.sr)
         else:
             self.record_table.reset()
-    
-        if processing:
-            self.recording_object = TableRec(
-                processing(self.input), self.record_table).play()
-        elif self.processing:
-            self.recording_object = TableRec(
-                self.processing(self.input), self.record_table).play()
-        else:
-            self.recording_object = TableRec(
-                self.input, self.record_table).play()
+        self.num_samples = self.take_samples
+
+        self.recording_object = TableRec(
+            self.get_source(processing), self.record_table).play()
 
         if self.pattern:
             self.pattern.play()
 
-        self.ctr_trig.play()
+        if self.hub:
+            self.count_start = self.hub.count()
+        else:
+            self.ctr_trig.play()
 
         self.stopper = TrigFunc(
             self.recording_object['trig'], self.on_recording_end)
+        if self.take_samples < self.record_table.getSize():
+            # The table is longer than the take, so stop by its logical length
+            self.end_caller = CallAfter(self.stop, time=self.take_samples / self.sr)
+
+    def record_ring(self, length=None):
+        """Bookmarks the start of a ring recording, pre_roll seconds back, and stops after length seconds if given."""
+        now = self.ring_position()
+        size = self.ring_table.getSize()
+        self.span_start = max(now - int(self.pre_roll * self.sr), now - size, 0)
+        self.span_end = now
+        self.ring_recording = True
+
+        if length:
+            max_length = (size - (now - self.span_start)) / self.sr
+            if length > max_length:
+                print("Truncating length to maximum of {} seconds.".format(max_length))
+                length = max_length
+            self.end_caller = CallAfter(self.stop, time=length)
+
+        if self.pattern:
+            self.pattern.play()
+
+    def get_span(self, copy=False):
+        """Returns the bookmarked ring recording, as a view of the ring table unless it wraps around or copy is set."""
+        size = self.ring_table.getSize()
+        end = self.ring_position() if self.ring_recording else self.span_end
+        start = max(self.span_start, end - size)
+        return circular_span(self.ring_buffer, start, end, copy=copy)
+
+    def record_to_file(self, path, processing=None, length=None, chunk_length=0.5, fsync_interval=5.0):
+        """Streams a recording of any length to a 16 bit WAV file, or a FLAC file if soundfile is installed.
+
+        Audio is filled into a table holding two chunks, which a writer thread drains to the file while
+        the other chunk is being filled, so at most chunk_length seconds are held in memory.
+
+        Args:
+            path: the file to write
+            processing: overrides the processing function for this recording
+            length: seconds after which to stop, None to record until stop()
+            chunk_length: seconds of audio per chunk, which bounds how far the file lags the input
+            fsync_interval: seconds between flushes of the file to disk, 0 for every chunk, None for only at stop
+        """
+        if path.lower().endswith(".flac") and soundfile is None:
+            raise ImportError("Writing FLAC requires the soundfile package.")
+        if self.stream_thread is not None and self.stream_thread.is_alive():
+            # The previous take is still being finished
+            self.stream_thread.join()
+
+        if path.lower().endswith(".flac"):
+            self.stream_file = open(path, "wb")
+            self.stream_writer = soundfile.SoundFile(
+                self.stream_file, mode="w", samplerate=int(self.sr), channels=1, format="FLAC")
+        else:
+            self.stream_file = open(path, "wb")
+            self.stream_writer = wave.open(self.stream_file, "wb")
+            self.stream_writer.setnchannels(1)
+            self.stream_writer.setsampwidth(2)
+            self.stream_writer.setframerate(int(self.sr))
+
+        if self.stream_table is None or self.chunk_length != chunk_length:
+            self.chunk_length = chunk_length
+            self.stream_table = NewTable(2 * chunk_length)
+            self.stream_buffer = np.asarray(self.stream_table.getBuffer())
+        self.fsync_interval = fsync_interval
+        self.last_fsync = time.time()
+        self.stream_written = 0
+
+        self.stream_fill = TableFill(self.get_source(processing), self.stream_table)
+        self.stream_counter = WritePositionCounter(self.stream_fill, self.stream_table.getSize())
+        self.streaming = True
+        self.stream_stopped.clear()
+        self.stream_thread = threading.Thread(target=self.stream_to_file, daemon=True)
+        self.stream_thread.start()
+
+        if length:
+            self.end_caller = CallAfter(self.end_stream, time=length)
+
+        if self.pattern:
+            self.pattern.play()
+
+    def stream_position(self):
+        """Returns the number of samples written to the stream table since streaming started."""
+        return self.stream_counter.count()
+
+    def stream_to_file(self):
+        """Drains the stream table to the file every half chunk until streaming stops, then finishes the file."""
+        while not self.stream_stopped.wait(self.chunk_length / 2):
+            self.drain_stream()
+        self.finish_stream()
+        if self.stream_end_async:
+            self.stream_finishing = False
+            self.stream_end_trig.play()
+
+    def drain_stream(self):
+        """Writes the samples filled since the last drain to the file, flushing it to disk per the fsync policy."""
+        end = self.stream_position()
+        size = self.stream_table.getSize()
+        if end - self.stream_written > size:
+            print("Stream writer fell behind, dropped {} samples.".format(end - self.stream_written - size))
+            self.stream_written = end - size
+        chunk = circular_span(self.stream_buffer, self.stream_written, end)
+        self.stream_written = end
+
+        if soundfile and isinstance(self.stream_writer, soundfile.SoundFile):
+            self.stream_writer.write(chunk)
+        else:
+            self.stream_writer.writeframes(
+                (np.clip(chunk, -1.0, 1.0) * 32767).astype("<i2").tobytes())
+
+        if self.fsync_interval is not None and time.time() - self.last_fsync >= self.fsync_interval:
+            self.sync_stream()
+
+    def sync_stream(self):
+        """Flushes the streamed file to disk."""
+        if soundfile and isinstance(self.stream_writer, soundfile.SoundFile):
+            self.stream_writer.flush()
+        self.stream_file.flush()
+        os.fsync(self.stream_file.fileno())
+        self.last_fsync = time.time()
+
+    def finish_stream(self):
+        """Writes out what is left and closes the file."""
+        self.drain_stream()
+        self.stream_writer.close()
+        self.stream_file.flush()
+        os.fsync(self.stream_file.fileno())
+        self.stream_file.close()
+
+    def end_stream(self):
+        """Ends a streamed take from the audio thread once its length has elapsed.
+
+        Only signals the writer thread, which finishes the file and then calls on_stop through
+        stream_end_trig, so no disk access blocks the audio callback.
+        """
+        if not self.streaming:
+            return
+        self.streaming = False
+        self.end_caller = None
+        self.stream_fill.stop()
+        self.stream_end_async = True
+        self.stream_finishing = True
+        self.stream_stopped.set()
+
+    def stop_stream(self):
+        """Stops streaming and waits for the writer thread to finish the file."""
+        self.streaming = False
+        self.stream_fill.stop()
+        self.stream_end_async = False
+        self.stream_stopped.set()
+        self.stream_thread.join()
 
     def stop(self):
+        if self.streaming:
+            if self.end_caller:
+                self.end_caller.stop()
+                self.end_caller = None
+            self.stop_stream()
+            self.on_recording_end()
+            return
+        if self.stream_finishing:
+            # A streamed take that reached its length is still being finished, on_stop follows from the writer
+            return
+
+        if self.ring_length:
+            if self.ring_recording:
+                self.span_end = self.ring_position()
+                self.num_samples = min(self.span_end - self.span_start, self.ring_table.getSize())
+                self.ring_recording = False
+                if self.end_caller:
+                    self.end_caller.stop()
+                    self.end_caller = None
+                self.on_recording_end()
+            return
+
         self.recording_object.stop()
-        num_samples_recorded = self.ctr.get()
-        trimmed_table = NewTable(num_samples_recorded / self.sr)
-        trimmed_table.copyData(self.record_table)
-        self.record_table = trimmed_table
+        if self.end_caller:
+            self.end_caller.stop()
+            self.end_caller = None
+        self.num_samples = min(self.elapsed_samples(), self.take_samples)
         self.on_recording_end()
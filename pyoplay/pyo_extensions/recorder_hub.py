@@ -0,0 +1,38 @@
+from pyo import *
+
+from pyo_extensions.audio_recorder import AudioRecorder
+
+
+class RecorderHub:
+    def __init__(self, input_object, sr, processing=None, counter_wrap=2 ** 23):
+        """Shares one processed input and one sample counter between many AudioRecorders.
+
+        Each recorder attached to the hub only adds its own TableRec.
+
+        Args:
+            input_object: the input PyoObject to record
+            sr: the sampling rate of the audio server
+            processing: a function that takes an input PyoObject, and returns a processed PyoObject to record,
+                built once for every attached recorder
+            counter_wrap: the shared counter wraps at this many samples, staying within the integers a
+                float32 signal holds exactly, so takes must be shorter than this
+        """
+        self.input = input_object
+        self.sr = sr
+        self.source = processing(self.input) if processing else self.input
+        self.counter_wrap = counter_wrap
+        self.ctr_trig = Trig()
+        self.ctr = Count(self.ctr_trig, max=self.counter_wrap)
+        self.ctr_trig.play()
+
+    def count(self):
+        """Returns the current value of the shared sample counter."""
+        return int(self.ctr.get())
+
+    def elapsed(self, start):
+        """Returns the samples counted since the counter read start, across a wrap."""
+        return (self.count() - start) % self.counter_wrap
+
+    def recorder(self, length=4, **kwargs):
+        """Returns a new AudioRecorder attached to the hub."""
+        return AudioRecorder(self.input, self.sr, length, hub=self, **kwargs)
@@ -2,7 +2,8 @@ from pyo import *
 
 
 class Sample:
-    def __init__(self, path=None, table=None, processing=None, parallel_processing=True, play_original=True, loop=0):
+    def __init__(self, path=None, table=None, processing=None, parallel_processing=True, play_original=True, loop=0,
+                 length=None):
         """Controls playback and processing for a sound file or table.
         
         Args:
@@ -14,6 +15,8 @@ class Sample:
             the original audio (True), or to the output of the previous effect (False). Defaults to True.
             play_original (bool, optional): Determines whether or not to play the original signal with the processed signal.
             loop (int, optional): Determines whether playback should be looped. Defaults to 0.
+            length (float, optional): Seconds of the table to play from its start, for tables holding a shorter
+            recording than their size. Defaults to None, the whole table.
         """
         if path:
             self.table = SndTable(path)
@@ -24,7 +27,14 @@ class Sample:
             self.duration = self.table.getDur()
             self.sr = self.table.getSamplingRate()
 
-        self.table_reader = TableRead(self.table, freq=1 / self.duration, loop=loop)
+        self.length = self.duration if length is None else min(length, self.duration)
+        if self.length < self.duration:
+            # Read only the start of the table, with the index ramping over the played fraction of it
+            self.phase = Linseg([(0, 0), (self.length, self.length / self.duration)], loop=loop)
+            self.table_reader = Pointer(self.table, self.phase)
+        else:
+            self.phase = None
+            self.table_reader = TableRead(self.table, freq=1 / self.duration, loop=loop)
         self.processing = processing
         self.parallel_processing = parallel_processing
         self.play_original = play_original
@@ -43,6 +53,8 @@ class Sample:
                     self.signal_chain.append(node)
 
     def play(self, num_channels=2, channel=0):
+        if self.phase:
+            self.phase.play()
         if self.play_original:
             if num_channels == 1:
                 self.table_reader = self.table_reader.out(channel)
@@ -53,6 +65,11 @@ class Sample:
 
     def stop(self):
         self.table_reader.stop()
+        if self.phase:
+            self.phase.stop()
 
     def set_loop(self, loop):
-        self.table_reader.setLoop(loop)
+        if self.phase:
+            self.phase.setLoop(loop)
+        else:
+            self.table_reader.setLoop(loop)
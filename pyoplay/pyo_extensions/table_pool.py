@@ -0,0 +1,115 @@
+from pyo import *
+import math
+import threading
+import numpy as np
+
+
+class TablePool:
+    def __init__(self, sr, max_bytes=2 ** 26):
+        """Keeps returned NewTables for reuse, so recording does not allocate a table per take.
+
+        Tables are bucketed by size in powers of two samples, a checkout returning a table at least
+        as long as asked for, which the caller plays back by its own logical length.
+
+        Args:
+            sr: the sampling rate of the audio server
+            max_bytes: the most memory the pool's tables may take, checked out and held together
+        """
+        self.sr = sr
+        self.max_bytes = max_bytes
+        self.free = {}  # bucket size in samples -> list of returned tables
+        self.checked_out = {}  # id of each checked out table -> its size in bytes
+        self.lock = threading.Lock()
+        self.sample_bytes = 4  # bytes per table sample, learned from the first table allocated
+        self.hits = 0
+        self.misses = 0
+        self.dropped = 0
+        self.bytes_held = 0
+        self.bytes_out = 0
+
+    def bucket(self, length):
+        """Returns the bucket size in samples of a table holding length seconds."""
+        # Rounded first so a length computed as samples / sr does not ceil up a bucket
+        return self.bucket_samples(math.ceil(round(length * self.sr, 6)))
+
+    def bucket_samples(self, samples):
+        """Returns the bucket size of a table holding a number of samples."""
+        return 1 << (max(1, samples) - 1).bit_length()
+
+    def bucket_of(self, table):
+        """Returns the bucket a table serves, the largest bucket not longer than it."""
+        return 1 << (table.getSize().bit_length() - 1)
+
+    def checkout(self, length):
+        """Returns a zeroed table holding at least length seconds.
+
+        Raises:
+            MemoryError: if a new table would take the pool over max_bytes even with no tables held.
+        """
+        bucket = self.bucket(length)
+        with self.lock:
+            tables = self.free.get(bucket)
+            if tables:
+                table = tables.pop()
+                nbytes = self.table_bytes(table)
+                self.bytes_held -= nbytes
+                self.hits += 1
+            else:
+                self.misses += 1
+                self.make_room((bucket + 1) * self.sample_bytes)
+                # Pad by half a sample so the size does not round down below the bucket
+                table = NewTable((bucket + 0.5) / self.sr)
+                nbytes = self.table_bytes(table)
+                self.sample_bytes = nbytes // table.getSize()
+            self.checked_out[id(table)] = nbytes
+            self.bytes_out += nbytes
+        if tables:
+            table.reset()
+        return table
+
+    def make_room(self, nbytes):
+        """Drops held tables, largest first, until nbytes more fit in max_bytes."""
+        for bucket in sorted(self.free, reverse=True):
+            tables = self.free[bucket]
+            while tables and self.bytes_out + self.bytes_held + nbytes > self.max_bytes:
+                self.bytes_held -= self.table_bytes(tables.pop())
+                self.dropped += 1
+        if self.bytes_out + self.bytes_held + nbytes > self.max_bytes:
+            raise MemoryError("Table pool budget of {} bytes exceeded.".format(self.max_bytes))
+
+    def release(self, table):
+        """Returns a table to the pool, dropping it if holding it would go over max_bytes."""
+        nbytes = self.table_bytes(table)
+        with self.lock:
+            self.bytes_out -= self.checked_out.pop(id(table), 0)
+            if self.bytes_out + self.bytes_held + nbytes > self.max_bytes:
+                self.dropped += 1
+                return
+            self.free.setdefault(self.bucket_of(table), []).append(table)
+            self.bytes_held += nbytes
+
+    def table_bytes(self, table):
+        return np.asarray(table.getBuffer()).nbytes
+
+    def stats(self):
+        """Returns the pool's hits, misses, dropped tables, and bytes held and checked out."""
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "dropped": self.dropped,
+                    "bytes_held": self.bytes_held, "bytes_out": self.bytes_out}
+
+    def clear(self):
+        """Drops every held table."""
+        with self.lock:
+            self.free = {}
+            self.bytes_held = 0
+
+
+default_pool = None
+
+
+def get_default_pool(sr):
+    """Returns the pool shared by recorders that are not given one, creating it on first use."""
+    global default_pool
+    if default_pool is None:
+        default_pool = TablePool(sr)
+    return default_pool
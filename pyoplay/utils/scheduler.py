@@ -0,0 +1,75 @@
+import heapq
+import itertools
+import threading
+import time
+
+
+class EventScheduler:
+    """Calls functions at scheduled times from one clock thread, keeping pending events in a heap.
+
+    Unlike utils.delay_func, scheduling an event creates no pyo objects, and fired events are
+    dropped from the heap so nothing has to be kept in scope.
+    """
+
+    def __init__(self):
+        self.events = []  # heap of (due time, sequence number, func, arg)
+        self.sequence = itertools.count()  # keeps events due at the same time in scheduling order
+        self.condition = threading.Condition()
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def schedule(self, delay, func, arg=None):
+        """Calls a function after a delay.
+
+        Args:
+            delay (float): Delay in seconds.
+            func (callable): Function to call after delay.
+            arg (tuple, optional): Tuple of arguments to provide to the function. Defaults to None.
+        """
+        self.schedule_many([(delay, func, arg)])
+
+    def schedule_many(self, events):
+        """Schedules a batch of events relative to the same moment.
+
+        Args:
+            events (list(tuple(float, callable, tuple))): A list of (delay, func, arg) tuples, arg may be None.
+        """
+        now = time.perf_counter()
+        with self.condition:
+            for delay, func, arg in events:
+                heapq.heappush(self.events, (now + delay, next(self.sequence), func, arg or ()))
+            self.condition.notify()
+
+    def clear(self):
+        """Drops all pending events."""
+        with self.condition:
+            self.events = []
+            self.condition.notify()
+
+    def stop(self):
+        """Drops all pending events and ends the clock thread."""
+        with self.condition:
+            self.running = False
+            self.events = []
+            self.condition.notify()
+        self.thread.join()
+
+    def run(self):
+        with self.condition:
+            while self.running:
+                if not self.events:
+                    self.condition.wait()
+                    continue
+                wait = self.events[0][0] - time.perf_counter()
+                if wait > 0:
+                    self.condition.wait(timeout=wait)
+                    continue
+                _, _, func, arg = heapq.heappop(self.events)
+                self.condition.release()
+                try:
+                    func(*arg)
+                except Exception as e:
+                    print("Scheduled event failed:", e)
+                finally:
+                    self.condition.acquire()
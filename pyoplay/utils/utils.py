@@ -1,5 +1,66 @@
 from pyo import *
-import bisect
+from collections import OrderedDict
+import threading
+import numpy as np
+
+class Quantizer:
+    """Quantizes values to the closest value in a list of quantized values, with the
+    midpoints between them computed once so the same grid can be reused cheaply."""
+
+    def __init__(self, quant):
+        """
+        Args:
+            quant (list[float]): Quantized value options, in increasing order.
+        """
+        self.quant = quant
+        self.values = np.asarray(quant)
+        values = self.values.astype(np.float64)
+        self.mids = (values[:-1] + values[1:]) / 2.0
+
+    def indices(self, value):
+        """Returns the index of the closest quantized value for a value or an array of values."""
+        return np.searchsorted(self.mids, value, side='right')
+
+    def __call__(self, value, with_index=False):
+        """Quantizes a value or a NumPy array of values.
+        Args:
+            value (float or numpy.ndarray): Value(s) to be quantized
+            with_index (bool, optional): Also return the index of the quantized value(s). Defaults to False.
+        Returns:
+            float or numpy.ndarray: Quantized input value(s), preceded by their indices if with_index.
+        """
+        ind = self.indices(value)
+        if np.ndim(ind) == 0:
+            ind = int(ind)
+            quantized = self.quant[ind]
+        else:
+            quantized = self.values[ind]
+        if with_index:
+            return ind, quantized
+        else:
+            return quantized
+
+
+_quantizers = OrderedDict()
+_max_quantizers = 8
+
+
+def get_quantizer(quant):
+    """Returns a Quantizer for a list of quantized values, reusing a recently prepared one for the same values."""
+    if isinstance(quant, np.ndarray):
+        key = (quant.dtype.str, quant.shape, quant.tobytes())
+    else:
+        key = tuple(quant)
+    quantizer = _quantizers.get(key)
+    if quantizer is None:
+        quantizer = Quantizer(quant)
+        _quantizers[key] = quantizer
+        if len(_quantizers) > _max_quantizers:
+            _quantizers.popitem(last=False)
+    else:
+        _quantizers.move_to_end(key)
+    return quantizer
+
 
 def quantize(value, quant, with_index=False):
     """Quantizes a value to the closest value in a list of quantized values.
@@ -9,13 +70,71 @@ def quantize(value, quant, with_index=False):
     Returns:
         float: Quantized input value.
     """
-    mids = [(quant[i] + quant[i + 1]) / 2.0
-            for i in range(len(quant) - 1)]
-    ind = bisect.bisect_right(mids, value)
-    if with_index:
-        return ind, quant[ind]
-    else:
-        return quant[ind]
+    return get_quantizer(quant)(value, with_index=with_index)
+
+
+def next_true_index(mask):
+    """Finds, for every position of a boolean array, the first True at or after it.
+
+    Args:
+        mask (numpy.ndarray): Boolean array.
+
+    Returns:
+        numpy.ndarray: Index of the next True for each position, len(mask) where there is none.
+            Has one extra trailing entry, equal to len(mask), so len(mask) is a valid position too.
+    """
+    indices = np.where(mask, np.arange(len(mask)), len(mask))
+    return np.minimum.accumulate(np.append(indices, len(mask))[::-1])[::-1]
+
+
+class WritePositionCounter:
+    """Counts the samples a TableFill has written into its circular table, from the fill's write position.
+
+    The count is exact as long as it is read at least once per lap of the table, and is kept in
+    Python so it does not lose precision on long runs like a Count signal does.
+    """
+
+    def __init__(self, fill, size):
+        """
+        Args:
+            fill (pyo.TableFill): The object filling the table.
+            size (int): Size of the table in samples.
+        """
+        self.fill = fill
+        self.size = size
+        self.samples = 0
+        self.pos = 0
+        self.lock = threading.Lock()  # Read from the audio thread as well as by callers
+
+    def count(self):
+        """Returns the number of samples written since filling started."""
+        with self.lock:
+            pos = self.fill.getCurrentPos()
+            self.samples += (pos - self.pos) % self.size
+            self.pos = pos
+            return self.samples
+
+
+def circular_span(buffer, start, end, copy=False):
+    """Returns samples of a circular buffer, by their count since filling started.
+
+    Args:
+        buffer (numpy.ndarray): The circular buffer.
+        start (int): First sample of the span.
+        end (int): Sample after the last of the span, at most len(buffer) after start.
+        copy (bool, optional): Return a copy even when the span does not wrap around. Defaults to False.
+
+    Returns:
+        numpy.ndarray: A view of the buffer, or a single concatenated copy if the span wraps around its end.
+    """
+    size = len(buffer)
+    end = max(end, start)
+    start_index = start % size
+    wrapped = start_index + end - start - size
+    if wrapped > 0:
+        return np.concatenate((buffer[start_index:], buffer[:wrapped]))
+    span = buffer[start_index:start_index + end - start]
+    return span.copy() if copy else span
 
 
 def linear_interpolate(x, x0, y0, x1, y1):
@@ -3,225 +3,554 @@ import sys
 sys.path.insert(1, os.path.join(sys.path[0], '..'))
 import time
 import math
+import numpy as np
 from pyo import *
 import matplotlib.pyplot as plt
 import threading
 import atexit
 import pickle
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 # from scipy.interpolate import UnivariateSpline
 
 from pyo_extensions.audio_recorder import AudioRecorder
 from pyo_extensions.pyo_client import PyoClient
 from pyo_extensions.sample import Sample
-from utils.utils import quantize
+from utils.utils import Quantizer, WritePositionCounter, circular_span, next_true_index
 
 
 class VoiceCapture:
     """VoiceCapture captures input, expecting voice, and creates sound objects that follow the pitch contour of the speech."""
 
-    def __init__(self, server_sr, length):
+    def __init__(self, server_sr, length, in_graph_analysis=False, background_processing=True, hub=None):
+        """
+        Args:
+            server_sr (int): Sampling rate of the audio server.
+            length (float): Default take length in seconds.
+            in_graph_analysis (bool, optional): Record the pitch and amplitude signals into tables alongside
+                the audio instead of polling them from Python every pitch_interval. Defaults to False.
+            background_processing (bool, optional): Run the post-processing of a take, and in continuous capture
+                the cleanup of each frame and the closing of sound objects, on a worker thread, only swapping the
+                finished playback table in on the audio side. Defaults to True.
+            hub (RecorderHub, optional): Hub to take the input and sample counter from, shared with other
+                recorders of the same input. Defaults to None.
+        """
         self.server_sr = server_sr
-        self.input = Input()
+        self.input = hub.input if hub else Input()
         self.minfreq = 50  # Used to high pass Yin detection
         self.pitch_detect = Yin(self.input, minfreq=self.minfreq, maxfreq=600)
         self.follower = Follower(self.input)
         self.length = length
-        self.pitch_detect_pattern = Pattern(self.get_pitch_amplitude, time=0.02)
+        self.pitch_interval = 0.02  # Seconds between pitch and amplitude frames
+        self.in_graph_analysis = in_graph_analysis
+        if self.in_graph_analysis:
+            self.pitch_detect_pattern = None
+            self.pitch_table = NewTable(self.length)
+            self.amplitude_table = NewTable(self.length)
+            self.pitch_recorder = None
+            self.amplitude_recorder = None
+        else:
+            self.pitch_detect_pattern = Pattern(self.get_pitch_amplitude, time=self.pitch_interval)
         self.recorder = AudioRecorder(
             self.input, self.server_sr, self.length,
-            on_stop=self.stop_receiving_attacks, pattern=self.pitch_detect_pattern)
+            on_stop=self.stop_receiving_attacks, pattern=self.pitch_detect_pattern, hub=hub)
 
         self.attack_detector = AttackDetector(self.input)
         self.receive_attacks = False
         self.attack_func = TrigFunc(self.attack_detector, self.receive_attack)
 
-        self.ctr_trig = Trig()
-        self.ctr = Count(self.ctr_trig)
-
         self.pitch_tolerance = 30  # Freq used to determine what constitues a jump in in pitch detection
         self.sound_object_tolerance = 50  # Freq used to determine what constitute a jump in attack translation
         self.sound_object_lookahead = 10  # Number of samples to lookahead for start of sound object from detected attack
         self.length_req = 2  # Length of Yin detection samples for minimum sound object length
         self.amp_avg_buffer = 0.5  # Floor of avergage amplitude used to determine silence
-        self.amplitudes = []
-        self.pitches = []
-        self.pitch_timestamps = []
+        self.frame_capacity = 0
+        self.num_frames = 0
+        self.allocate_frames(self.length)
         self.attacks = []
         self.attack_timestamps = []
         self.sound_objects = []
         self.playback = None
+        self.contour_resolution = 0.005  # Seconds between points of the rendered pitch contour
+        self.contour = None
+        self.notes = None
+        self.contour_table = None
+        self.note_table = None
+        self.pitch_reader = None  # Pitch contour in Hz, read in phase with playback
+        self.note_reader = None  # MIDI note of the pitch contour, 0 where silent, read in phase with playback
         self.playing = False
         self.record_callback = None
 
+        self.background_processing = background_processing
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.playback_ready = None  # Future resolved with the playback Sample once a take is processed
+        self.playback_audio = None
+        self.swap_trig = Trig()
+        self.swap_func = TrigFunc(self.swap_trig, self.swap_playback_table)
+
+        self.continuous = False
+        self.segment_callback = None
+        self.rolling_table = None
+        self.rolling_fill = None
+        self.rolling_counter = None  # Samples captured since continuous capture started
+        self.sample_buffer = None  # Sample count of each frame in continuous capture, exact however long it runs
+        self.pending_attacks = []  # samples of attacks waiting for the frames either side of them, kept on the audio side
+        self.open_attacks = []  # frames of attacks whose sound objects are not complete yet, kept by the frame work
+        self.frame_work = None  # Future of the latest frame work submitted in continuous capture
+        self.amplitude_sum = 0.0
+
+    def allocate_frames(self, length):
+        """Preallocates the ring buffers holding pitch, amplitude and timestamp frames for a take of length seconds."""
+        capacity = math.ceil(length / self.pitch_interval) + 8  # headroom for Pattern jitter
+        if capacity > self.frame_capacity:
+            self.frame_capacity = capacity
+            self.pitch_buffer = np.zeros(capacity, dtype=np.float32)
+            self.amplitude_buffer = np.zeros(capacity, dtype=np.float32)
+            self.timestamp_buffer = np.zeros(capacity, dtype=np.float32)
+            self.processed_buffer = np.zeros(capacity, dtype=np.float32)
+        self.num_frames = 0
+
+    def get_frames(self, buffer):
+        """Returns the frames held in a ring buffer, oldest first."""
+        if self.num_frames <= self.frame_capacity:
+            return buffer[:self.num_frames]
+        i = self.num_frames % self.frame_capacity
+        return np.concatenate((buffer[i:], buffer[:i]))
+
+    def get_frame_range(self, buffer, start, stop):
+        """Returns frames start (inclusive) to stop (exclusive), counted since capture started, from a ring buffer."""
+        return buffer[np.arange(start, stop) % self.frame_capacity]
+
+    @property
+    def pitches(self):
+        return self.get_frames(self.pitch_buffer)
+
+    @property
+    def amplitudes(self):
+        return self.get_frames(self.amplitude_buffer)
+
+    @property
+    def pitch_timestamps(self):
+        return self.get_frames(self.timestamp_buffer)
+
     def receive_attack(self):
-        if self.receive_attacks:
+        if self.continuous:
+            self.pending_attacks.append(self.current_sample())
+        elif self.receive_attacks:
             self.attacks.append(self.pitch_detect.get())
-            self.attack_timestamps.append(self.ctr.get() / self.server_sr)
+            self.attack_timestamps.append(self.recorder.elapsed_samples() / self.server_sr)
+
+    def current_time(self):
+        """Returns the capture time in seconds, counted from the start of the take or of continuous capture."""
+        if not self.continuous:
+            return self.recorder.elapsed_samples() / self.server_sr
+        return self.current_sample() / self.server_sr
+
+    def current_sample(self):
+        """Returns the number of samples captured since continuous capture started."""
+        return self.rolling_counter.count()
+
+    def record_continuous(self, segment_callback, buffer_length=10.0):
+        """Captures continuously, emitting each sound object as soon as it closes.
+
+        Audio goes into a circular table and pitch frames into the frame ring buffers, both holding
+        the last buffer_length seconds, so nothing needs to be re-armed or reallocated.
+
+        Args:
+            segment_callback (callable): Called with (segment, audio) for each completed sound object. segment is a
+                list of (time, freq) tuples starting at 0 and padded with silence like VoiceCapture.segment,
+                audio a NumPy copy of the recording under it. Runs on the worker thread when background_processing
+                is set.
+            buffer_length (float, optional): Seconds of audio and pitch frames kept. Defaults to 10.0.
+        """
+        if self.playing:
+            self.stop()
+        if self.frame_work is not None:
+            wait([self.frame_work])  # let the last capture finish with the buffers before they are reset
+        self.segment_callback = segment_callback
+        self.allocate_frames(buffer_length)
+        if self.sample_buffer is None or len(self.sample_buffer) != self.frame_capacity:
+            self.sample_buffer = np.zeros(self.frame_capacity, dtype=np.int64)
+        self.pending_attacks = []
+        self.open_attacks = []
+        self.amplitude_sum = 0.0
+        if self.rolling_table is None or self.rolling_table.getDur() < buffer_length:
+            self.rolling_table = NewTable(buffer_length)
+        self.rolling_buffer = np.asarray(self.rolling_table.getBuffer())
+        self.rolling_fill = TableFill(self.input, self.rolling_table)
+        self.rolling_counter = WritePositionCounter(self.rolling_fill, self.rolling_table.getSize())
+        if self.pitch_detect_pattern is None:
+            self.pitch_detect_pattern = Pattern(self.get_pitch_amplitude, time=self.pitch_interval)
+        self.continuous = True
+        self.pitch_detect_pattern.play()
+
+    def stop_continuous(self):
+        """Stops continuous capture, closing sound objects still open at the last frame."""
+        if self.continuous:
+            self.pitch_detect_pattern.stop()
+            self.rolling_fill.stop()
+            self.continuous = False
+            self.pending_attacks = []
+            if self.background_processing:
+                self.frame_work = self.executor.submit(self.close_open_attacks, self.num_frames - 1)
+            else:
+                self.close_open_attacks(self.num_frames - 1)
+
+    def attach_attacks(self):
+        """Attaches pending attacks to their closest frame once the frames either side of them exist.
+
+        Returns:
+            list: Frames of the attacks attached to the newest frame.
+        """
+        k = self.num_frames - 1
+        sample = self.sample_buffer[k % self.frame_capacity]
+        previous = self.sample_buffer[(k - 1) % self.frame_capacity]
+        attached = []
+        still_pending = []
+        for attack_sample in self.pending_attacks:
+            if sample < attack_sample:
+                still_pending.append(attack_sample)
+                continue
+            closer_to_previous = k > 0 and attack_sample - previous <= sample - attack_sample
+            attached.append(k - 1 if closer_to_previous else k)
+        self.pending_attacks = still_pending
+        return attached
+
+    def process_continuous_frame(self, k, attached):
+        """Cleans up pitch frame k and closes any sound objects it completes.
+
+        Args:
+            k (int): Frame to process, counted since capture started.
+            attached (list): Frames of the attacks attached when frame k was received.
+        """
+        i = k % self.frame_capacity
+        pitch = self.pitch_buffer[i]
+        self.amplitude_sum += self.amplitude_buffer[i]
+        amp_avg = self.amplitude_sum / (k + 1)  # running average, as the take has no end
+        voiced = pitch > self.minfreq + 40 and self.amplitude_buffer[i] > self.amp_avg_buffer * amp_avg
+        jump = k > 0 and abs(self.pitch_buffer[(k - 1) % self.frame_capacity] - pitch) > self.pitch_tolerance
+        self.processed_buffer[i] = 2 * pitch if voiced and not jump and k > 0 else 0
+
+        self.open_attacks.extend(attached)
+        still_open = []
+        for attack_frame in self.open_attacks:
+            # Frames keep arriving while this runs, so check against the newest one written
+            if self.num_frames - attack_frame > self.frame_capacity:
+                continue  # its frames have been overwritten
+            if not self.close_sound_object(attack_frame, k):
+                still_open.append(attack_frame)
+        self.open_attacks = still_open
+
+    def close_open_attacks(self, last_frame):
+        """Closes the sound objects still open once no more frames will come."""
+        for attack_frame in self.open_attacks:
+            if last_frame - attack_frame < self.frame_capacity:
+                self.close_sound_object(attack_frame, last_frame, final=True)
+        self.open_attacks = []
+
+    def close_sound_object(self, attack_frame, last_frame, final=False):
+        """Looks for the sound object following an attack in the frames received so far.
+
+        Args:
+            attack_frame (int): Frame closest to the attack.
+            last_frame (int): Newest frame received.
+            final (bool, optional): No more frames will come, so the last frame ends the sound object. Defaults to False.
+
+        Returns:
+            bool: True if the sound object is complete (emitted or rejected), False if more frames are needed.
+        """
+        pitches = self.get_frame_range(self.processed_buffer, attack_frame, last_frame + 1)
+
+        # Look ahead to see where pitches start in relation to detected attack
+        start = min(next_true_index(pitches != 0)[0], self.sound_object_lookahead)
+        if start == len(pitches) and not final:
+            return False
+
+        # End sound object at a big jump or a dropped pitch, which needs the frame after it
+        ends_object = (np.abs(np.diff(pitches[start:])) > self.sound_object_tolerance) | (pitches[start + 1:] == 0)
+        if final:
+            ends_object = np.append(ends_object, True)
+        if not ends_object.any():
+            return False
+        end = start + int(np.argmax(ends_object))
+
+        # Reject sound objects shorter than determined length
+        if end - start > self.length_req:
+            samples = self.get_frame_range(self.sample_buffer, attack_frame + start, attack_frame + end)
+            self.emit_sound_object(samples, pitches[start:end])
+        return True
+
+    def emit_sound_object(self, samples, pitches):
+        """Cuts the audio under a completed sound object out of the rolling table and hands both to the segment callback.
+
+        Args:
+            samples (numpy.ndarray): Sample counts of the sound object's frames since continuous capture started.
+            pitches (numpy.ndarray): Pitch of each frame.
+        """
+        size = self.rolling_table.getSize()
+        start_sample = max(int(samples[0]), self.rolling_counter.samples - size)
+        audio = circular_span(self.rolling_buffer, start_sample, int(samples[-1]), copy=True)
+
+        # Segment times are relative to the sound object, so float seconds stay exact
+        times = ((samples - samples[0]) / self.server_sr).tolist()
+        sound_object = list(zip(times, pitches.tolist()))
+        segment = [(0, 0)] + sound_object + [(times[-1], 0)]
+        if self.segment_callback:
+            self.segment_callback(segment, audio)
 
     def stop_receiving_attacks(self):
         self.receive_attacks = False
 
-        # Filter Yin pitch detection
-        self.pitch_processing()
-
-        # Apply detected attacks to detected pitched
-        self.attack_translation()
+        if self.in_graph_analysis:
+            self.read_analysis_tables()
 
-        # Mask recording with detected sound objects
-        self.process_for_playback()
+        # Called from the recorder's end trigger, so keep the heavy work off the audio thread
+        self.playback_ready = Future()
+        if self.background_processing:
+            self.executor.submit(self.post_process)
+        else:
+            self.post_process()
 
         # Play back masked sample and basic synthesized sound objects
         # self.play()
 
+    def post_process(self):
+        """Turns the raw take into sound objects and a masked playback buffer, then asks the audio side to swap it in."""
+        try:
+            # Filter Yin pitch detection
+            self.pitch_processing()
+
+            # Apply detected attacks to detected pitched
+            self.attack_translation()
+
+            # Mask recording with detected sound objects
+            self.playback_audio = self.render_playback()
+
+            # Sample the pitch contour for in-graph playback
+            self.contour, self.notes = self.render_contour()
+        except Exception as e:
+            self.playback_ready.set_exception(e)
+            raise
+
+        if self.background_processing:
+            self.swap_trig.play()
+        else:
+            self.swap_playback_table()
+
+    def record_analysis_tables(self):
+        """Starts recording the pitch and amplitude signals into tables, in step with the audio recording."""
+        length = self.recorder.record_table.getDur()
+        if length > self.pitch_table.getDur():
+            self.pitch_table = NewTable(length)
+            self.amplitude_table = NewTable(length)
+        self.pitch_recorder = TableRec(self.pitch_detect, self.pitch_table).play()
+        self.amplitude_recorder = TableRec(self.follower, self.amplitude_table).play()
+
+    def read_analysis_tables(self):
+        """Downsamples the recorded pitch and amplitude tables into the frame buffers, one frame per pitch_interval."""
+        self.pitch_recorder.stop()
+        self.amplitude_recorder.stop()
+        num_samples = self.recorder.num_samples
+        hop = int(round(self.pitch_interval * self.server_sr))
+        positions = np.arange(0, num_samples, hop)
+        self.allocate_frames(len(positions) * self.pitch_interval)
+        self.num_frames = len(positions)
+        self.pitch_buffer[:self.num_frames] = np.asarray(self.pitch_table.getBuffer())[positions]
+        self.amplitude_buffer[:self.num_frames] = np.asarray(self.amplitude_table.getBuffer())[positions]
+        self.timestamp_buffer[:self.num_frames] = positions / self.server_sr
+
     def pitch_processing(self):
         """Cleans up the raw Yin pitch detection."""
-        self.processed_pitches = [0]
-        amp_avg = sum(self.amplitudes) / len(self.amplitudes)
-
-        i = 0
-        pitches_dropped = 0
-        silence_dropped = 0
-        current_length = 1
-        current_start = 1
-        t = 0
-        for pitch, timestamp in zip(self.pitches, self.pitch_timestamps):
-            if 0 < i < len(self.pitches):
-                # Drop if not silent or super low
-                if pitch > self.minfreq + 40 and self.amplitudes[i] > self.amp_avg_buffer * amp_avg:
-                    diff = abs(self.pitches[i - 1] - pitch)
-                    if diff > self.pitch_tolerance:  # Drop if a big jump
-                        self.processed_pitches.append(0)
-                        pitches_dropped += 1
-                    else:
-                        self.processed_pitches.append(pitch)
-                else:
-                    self.processed_pitches.append(0)
-                    silence_dropped += 1
-            i += 1
-
-        self.processed_pitches = [2 * p for p in self.processed_pitches]
-        
+        pitches = self.pitches
+        amplitudes = self.amplitudes
+        amp_avg = amplitudes.mean(dtype=np.float64)
+
+        # Drop if silent or super low
+        voiced = (pitches > self.minfreq + 40) & (amplitudes > self.amp_avg_buffer * amp_avg)
+        # Drop if a big jump from the previous estimate
+        jumps = np.abs(np.diff(pitches, prepend=pitches[:1])) > self.pitch_tolerance
+        self.processed_pitches = np.where(voiced & ~jumps, pitches, 0)
+        self.processed_pitches[:1] = 0
+        self.processed_pitches *= 2
+
         # Debug logging
-        # print("Dropped %d estimates out of %d." % (pitches_dropped + silence_dropped, len(self.pitches)))
-        # print("\t%d pitch" % pitches_dropped)
-        # print("\t%d amplitude" % silence_dropped)
+        # print("Dropped %d estimates out of %d." % (np.count_nonzero(self.processed_pitches == 0), len(pitches)))
+        # print("\t%d pitch" % np.count_nonzero(voiced & jumps))
+        # print("\t%d amplitude" % np.count_nonzero(~voiced))
 
     def attack_translation(self):
         """Creates sound objects based on pitch detection and attack detection."""
-        self.sound_objects = []
-        for attack in self.attack_timestamps:
-            closest_timestamp = quantize(attack, self.pitch_timestamps)
-            closest_timestamp_index = self.pitch_timestamps.index(
-                closest_timestamp)
-
-            # Look ahead to see where pitches start in relation to detected attack
-            for _ in range(self.sound_object_lookahead):
-                if closest_timestamp_index < len(self.processed_pitches) \
-                        and self.processed_pitches[closest_timestamp_index] == 0:
-                    closest_timestamp_index += 1
-                else:
-                    break
-
-            i = closest_timestamp_index
-            sound_object = []
-
-            while i < len(self.pitch_timestamps) - 1:
-                diff = abs(self.processed_pitches[i + 1] - self.processed_pitches[i])
-                # End sound object if a big jump
-                if diff > self.sound_object_tolerance or self.processed_pitches[i + 1] == 0:
-                    break
-                else:
-                    sound_object.append((self.pitch_timestamps[i], self.processed_pitches[i]))
-                i += 1
-
-            # Reject sound objects shorter than determined length
-            if sound_object and len(sound_object) > self.length_req:
-                self.sound_objects.append(sound_object)
+        pitch_timestamps = self.pitch_timestamps.astype(np.float64)
+        pitches = self.processed_pitches
+        num_frames = len(pitch_timestamps)
+
+        # Closest pitch frame to every attack
+        attack_indices = Quantizer(pitch_timestamps).indices(self.attack_timestamps)
+
+        # Look ahead to see where pitches start in relation to detected attack
+        next_pitched = next_true_index(pitches != 0)
+        starts = np.minimum(next_pitched[attack_indices], attack_indices + self.sound_object_lookahead)
+
+        # End sound object at a big jump or a dropped pitch
+        ends_object = np.ones(num_frames, dtype=bool)
+        ends_object[:-1] = (np.abs(np.diff(pitches)) > self.sound_object_tolerance) | (pitches[1:] == 0)
+        ends = next_true_index(ends_object)[starts]
+
+        # Reject sound objects shorter than determined length
+        keep = ends - starts > self.length_req
+        self.sound_objects = [list(zip(pitch_timestamps[start:end].tolist(), pitches[start:end].tolist()))
+                              for start, end in zip(starts[keep], ends[keep])]
 
         self.segment = [(0, 0)]
         for so in self.sound_objects:
             self.segment += ([(so[0][0], 0)] + so + [(so[-1][0], 0)])
-        self.segment += [(self.recorder.record_table.getSize() /
-                          self.server_sr, 0)]
+        self.segment += [(self.recorder.get_duration(), 0)]
 
     def process_for_playback(self):
         """Applies the sound objects as a mask to the recording and plays recording and synthesized sound objects."""
+        self.playback_audio = self.render_playback()
+        self.contour, self.notes = self.render_contour()
+        self.swap_playback_table()
+
+    def render_playback(self):
+        """Returns a copy of the recording masked with the sound objects, leaving the table untouched."""
         self.pitch_timestamps[0] = 0
-        self.playback = Sample(table=self.recorder.record_table,
+        audio = np.asarray(self.recorder.record_table.getBuffer())[:self.recorder.num_samples].copy()
+        audio *= self.playback_envelope(len(audio), self.recorder.record_table.getSamplingRate())
+        return audio
+
+    def render_contour(self):
+        """Returns the segment's pitch contour and its MIDI notes sampled on a regular grid spanning the recording."""
+        duration = self.recorder.get_duration()
+        size = max(1, math.ceil(duration / self.contour_resolution))
+        times = np.array([s[0] for s in self.segment])
+        freqs = np.array([s[1] for s in self.segment])
+        contour = np.interp(np.arange(size) * (duration / size), times, freqs)
+        with np.errstate(divide='ignore'):
+            notes = np.where(contour > 0, np.floor(12 * np.log2(contour / 440.0) + 69), 0)
+        return contour.astype(np.float32), notes.astype(np.float32)
+
+    def swap_contour_tables(self):
+        """Writes the rendered contour into tables read in phase with the playback table."""
+        size = len(self.contour)
+        if self.contour_table is None or self.contour_table.getSize() != size:
+            self.contour_table = DataTable(size)
+            self.note_table = DataTable(size)
+        np.asarray(self.contour_table.getBuffer())[:] = self.contour
+        np.asarray(self.note_table.getBuffer())[:] = self.notes
+        self.contour_table.refreshView()
+        self.note_table.refreshView()
+
+        # Keep the same readers across takes so anything following them stays connected
+        freq = 1 / self.playback.length
+        if self.pitch_reader is None:
+            self.pitch_reader = TableRead(self.contour_table, freq=freq, loop=1, interp=2).stop()
+            self.note_reader = TableRead(self.note_table, freq=freq, loop=1, interp=1).stop()
+        else:
+            self.pitch_reader.setTable(self.contour_table)
+            self.pitch_reader.setFreq(freq)
+            self.note_reader.setTable(self.note_table)
+            self.note_reader.setFreq(freq)
+
+    def swap_playback_table(self):
+        """Writes the rendered playback audio into the recording table and sets up playback."""
+        table = self.recorder.record_table
+        np.asarray(table.getBuffer())[:len(self.playback_audio)] = self.playback_audio
+        table.refreshView()
+        self.playback = Sample(table=table, length=self.recorder.get_duration(),
                                processing=[(Harmonizer, {"transpo": 0})], parallel_processing=False, play_original=False, loop=1)
+        self.swap_contour_tables()
 
-        for i in range(len(self.segment)):  # apply all silence in the segement to the recording
-            if i > 0:
-                if self.segment[i - 1][1] == 0:  # if the previous segment freq is 0
-                    start_sample = math.floor(self.segment[i - 1][0] * self.playback.sr)
-                    end_sample = math.floor(self.segment[i][0] * self.playback.sr)
-                    for sample in range(start_sample, end_sample):
-                        self.playback.table.put(0.0, pos=sample)
-
-        attack_samples = math.floor(0.01 * self.playback.sr)
-        decay_samples = math.floor(0.05 * self.playback.sr)
-        i = 0
-        while i < self.playback.table.getSize():  # apply basic attack/decay to not masked portions to not pop
-            sample = self.playback.table.get(i)
-            if sample == 0.0:
-                i += 1
-                continue
-            start = i
-            end = start + 1
-            end_val = self.playback.table.get(end)
-            while end_val != 0.0 or end == len(self.playback.table):
-                end += 1
-                end_val = self.playback.table.get(end)
-            attack_i = start
-            while attack_i < start + attack_samples or attack_i == end:  # attack
-                self.playback.table.put(self.playback.table.get(attack_i) * ((attack_i - start) / attack_samples), pos=attack_i)
-                attack_i += 1
-            decay_i = end
-            while decay_i > end - decay_samples or decay_i == start:  # decay
-                self.playback.table.put(self.playback.table.get(decay_i) * ((end - decay_i) / decay_samples), pos=decay_i)
-                decay_i -= 1
-            i = end
-
-        # self.ls = Linseg(self.segment, loop=True)
-        # self.saw = SuperSaw(freq=self.ls).mix(2).out()
+        # self.saw = SuperSaw(freq=self.pitch_reader).mix(2).out()
 
         if self.record_callback:
             self.record_callback()
-        
+        if self.playback_ready and not self.playback_ready.done():
+            self.playback_ready.set_result(self.playback)
+
+    def playback_envelope(self, num_samples, sr):
+        """Returns the gain to apply to each sample of the recording: zero where the segment
+        is silent, with a short attack and decay around every sounding region so it does not pop."""
+        times = np.array([s[0] for s in self.segment])
+        freqs = np.array([s[1] for s in self.segment])
+        silent = freqs[:-1] == 0  # a segment point with freq 0 silences until the next point
+        silence_starts = np.clip(np.floor(times[:-1][silent] * sr).astype(int), 0, num_samples)
+        silence_ends = np.clip(np.floor(times[1:][silent] * sr).astype(int), 0, num_samples)
+
+        # Count overlapping silent regions covering each sample
+        coverage = np.zeros(num_samples + 1, dtype=int)
+        np.add.at(coverage, silence_starts, 1)
+        np.add.at(coverage, silence_ends, -1)
+        sounding = np.cumsum(coverage[:-1]) == 0
+        envelope = sounding.astype(np.float32)
+
+        edges = np.diff(np.concatenate(([0], sounding.astype(np.int8), [0])))
+        starts = np.flatnonzero(edges == 1)
+        ends = np.flatnonzero(edges == -1)
+        lengths = ends - starts
+
+        attack_samples = math.floor(0.01 * sr)
+        decay_samples = math.floor(0.05 * sr)
+        attack_steps = np.arange(attack_samples)
+        in_region = attack_steps[None, :] < lengths[:, None]
+        attack_ramp = np.broadcast_to(attack_steps / attack_samples, in_region.shape)
+        envelope[(starts[:, None] + attack_steps[None, :])[in_region]] *= attack_ramp[in_region]
+        decay_steps = np.arange(1, decay_samples)
+        in_region = decay_steps[None, :] <= lengths[:, None]
+        decay_ramp = np.broadcast_to(decay_steps / decay_samples, in_region.shape)
+        envelope[(ends[:, None] - decay_steps[None, :])[in_region]] *= decay_ramp[in_region]
+        return envelope
+
     def get_pitch_amplitude(self):
         """Saves a current pitch detection and amplitude value."""
-        self.pitch_timestamps.append(self.ctr.get() / self.server_sr)
-        self.pitches.append(self.pitch_detect.get())
-        self.amplitudes.append(self.follower.get())
+        i = self.num_frames % self.frame_capacity
+        if self.continuous:
+            self.sample_buffer[i] = self.current_sample()
+            self.timestamp_buffer[i] = self.sample_buffer[i] / self.server_sr
+        else:
+            self.timestamp_buffer[i] = self.current_time()
+        self.pitch_buffer[i] = self.pitch_detect.get()
+        self.amplitude_buffer[i] = self.follower.get()
+        self.num_frames += 1
+        if self.continuous:
+            # Only the frame write and attack bookkeeping stay on the audio side
+            attached = self.attach_attacks()
+            if self.background_processing:
+                self.frame_work = self.executor.submit(self.process_continuous_frame, self.num_frames - 1, attached)
+            else:
+                self.process_continuous_frame(self.num_frames - 1, attached)
 
     def play(self):
         """Plays back the recorded sample and basic synthesized sound object."""
         self.playing = True
-        # self.ls.play()
         self.playback.play()
+        self.pitch_reader.play()
+        self.note_reader.play()
 
     def stop(self):
         """Stops playback of the recorded sample and basic synthesized sound object."""
         self.playing = False
         self.playback.stop()
+        self.pitch_reader.stop()
+        self.note_reader.stop()
 
     def record(self, length=None, wait=False, record_callback=None):
         """Start recording and detecting pitch and attacks."""
         if self.playing:
             self.stop()
         self.record_callback = record_callback
-        self.pitches = []
-        self.pitch_timestamps = []
+        self.allocate_frames(min(length or self.recorder.record_table.getDur(), self.recorder.max_length))
         self.attacks = []
         self.attack_timestamps = []
         self.receive_attacks = True
-        self.ctr_trig.play()
 
         if length:
             self.recorder.record(length=length)
         else:
             self.recorder.record()
 
+        if self.in_graph_analysis:
+            self.record_analysis_tables()
+
         if wait:
             time.sleep(self.recorder.length)
 
@@ -13,14 +13,8 @@ length = 4.0
 v = VoiceCapture(c.audio_server.getSamplingRate(), length)
 m = Midifier("IAC Driver VoiceCapture")
 
-trig = None
-trig_func = None
-
 def do():
-    global trig, trig_func
-    trig = v.playback.table_reader['trig']
-    trig_func = TrigFunc(trig, m.midify, arg=(v.segment,))
+    m.follow(v.note_reader)
     v.play()
-    m.midify(v.segment)
 
 v.record(record_callback=do)
@@ -4,20 +4,32 @@ sys.path.insert(1, os.path.join(sys.path[0], '..'))
 import time
 import mido
 import math
+import numpy as np
 from pretty_midi import hz_to_note_number
 from pyo import *
 
 from midi.mido_client import MidoClient
-from utils.utils import quantize, linear_interpolate, delay_func
+from utils.utils import quantize, linear_interpolate
+from utils.scheduler import EventScheduler
 
 class Midifier:
     """Midifier receives segments created by a VoiceCapture object and converts them to MIDI for external synthesis."""
-    def __init__(self, output_device=""):
+    def __init__(self, output_device="", sampling_interval=0.05):
+        """
+        Args:
+            output_device (str, optional): Name of the MIDI output to send notes to. Defaults to "".
+            sampling_interval (float, optional): Time step in seconds at which the pitch contour is
+                sampled into notes, down to 0.001. Defaults to 0.05.
+        """
         self.output_device = output_device
         self.mido_client = MidoClient(output_devices=[self.output_device])
         self.port = self.mido_client.output_ports[self.output_device]
-        self.sampling_interval = 0.05
-        self.delays = []
+        self.sampling_interval = sampling_interval
+        self.scheduler = EventScheduler()
+        self.following_note = 0
+        self.note_signal = None
+        self.note_change = None
+        self.note_func = None
 
 
     def process_segment(self, segment):
@@ -65,28 +77,51 @@ class Midifier:
         times, freqs = self.process_segment(segment)
         length = segment[-1][0]
 
-        midi_notes = []
-
-        t = 0
-        prev_midi_note = self.midi_note_at_t(t, times, freqs)
-        note_on_time = 0.0
-        while t < length:
-            midi_note = self.midi_note_at_t(t, times, freqs)
-            if midi_note != prev_midi_note:
-                # end prev note
-                midi_notes.append((prev_midi_note, note_on_time, t))
-                note_on_time = t
-                prev_midi_note = midi_note
-            t += self.sampling_interval
-
-        midi_notes = list(filter(lambda note: note[0] != 0, midi_notes))
-
-        for note in midi_notes:
-            def on(n): 
-                return lambda: self.port.send(mido.Message('note_on', note=n, velocity=32))
-            def off(n):
-                return lambda: self.port.send(mido.Message('note_off', note=n, velocity=32))
-            self.delays.append(delay_func(note[1], on(note[0])))
-            self.delays.append(delay_func(note[2], off(note[0])))
-        
+        # Sample the contour on the whole time grid at once
+        t = np.arange(0, length, self.sampling_interval)
+        f = np.interp(t, times, freqs)
+
+        # Convert frequency to MIDI
+        with np.errstate(divide='ignore', invalid='ignore'):
+            notes = np.where(f > 0, np.floor(hz_to_note_number(f)), 0).astype(int)
+
+        # Run-length encode the notes, each run ending where the next begins
+        run_starts = np.flatnonzero(np.diff(notes, prepend=notes[:1] - 1))
+        run_ends = np.append(t[run_starts[1:]], length)
+        midi_notes = [(note, on, off) for note, on, off in
+                      zip(notes[run_starts].tolist(), t[run_starts].tolist(), run_ends.tolist())
+                      if note != 0]
+
+        events = []
+        for note, on, off in midi_notes:
+            events.append((on, self.port.send, (mido.Message('note_on', note=note, velocity=32),)))
+            events.append((off, self.port.send, (mido.Message('note_off', note=note, velocity=32),)))
+        self.scheduler.schedule_many(events)
+
         return midi_notes
+
+
+    def follow(self, note_signal):
+        """Sends MIDI notes following a signal of MIDI note numbers, such as VoiceCapture.note_reader.
+
+        Python is only called when the note changes, so a looping contour needs no per-loop scheduling.
+
+        Args:
+            note_signal (pyo.PyoObject): Signal of integer MIDI note numbers, 0 meaning silence.
+        """
+        if self.following_note:
+            self.port.send(mido.Message('note_off', note=self.following_note, velocity=32))
+            self.following_note = 0
+        self.note_signal = note_signal
+        self.note_change = Change(note_signal)
+        self.note_func = TrigFunc(self.note_change, self.note_changed)
+
+
+    def note_changed(self):
+        """Ends the sounding note and starts the one the followed signal changed to."""
+        note = int(self.note_signal.get())
+        if self.following_note:
+            self.port.send(mido.Message('note_off', note=self.following_note, velocity=32))
+        if note:
+            self.port.send(mido.Message('note_on', note=note, velocity=32))
+        self.following_note = note